@@ -3,36 +3,469 @@
 Librosaを使用した音声分析機能を提供
 """
 
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import uuid
+import warnings
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import librosa
+import soxr
+import soundfile as sf
 import numpy as np
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional
-from scipy.spatial.distance import euclidean
-from fastdtw import fastdtw
+from typing import BinaryIO, Dict, List, Tuple, Optional, Union
+from scipy.ndimage import maximum_filter1d, minimum_filter1d
+from scipy.spatial.distance import cdist
+from numba import njit
+
+logger = logging.getLogger(__name__)
+
+# librosaの読み込みフォールバック時の警告を抑制（load_audioのたびに設定しない）
+warnings.filterwarnings('ignore', category=UserWarning, module='librosa')
+warnings.filterwarnings('ignore', category=FutureWarning, module='librosa')
+warnings.filterwarnings('ignore', message='PySoundFile failed')
+
+try:
+    import simsimd
+except ImportError:
+    # SIMDカーネルが使えない環境ではscipyのcdistで計算
+    simsimd = None
+
+try:
+    import av
+except ImportError:
+    # PyAVが使えない環境では3GP/AMRをFFmpegのサブプロセスで変換
+    av = None
+
+
+# DTWに使う最大フレーム数（約9秒、フレーム間隔は約23ms）
+# これを超える長い録音は時間軸を平均プーリングして計算量を抑える
+MAX_DTW_FRAMES = 400
+
+# 整数PCMのWAVを[-1, 1]に正規化するための（オフセット, 倍率）
+_WAV_NORMALIZATION = {
+    np.dtype(np.int16): (0.0, 1.0 / 32768.0),
+    np.dtype(np.int32): (0.0, 1.0 / 2147483648.0),
+    np.dtype(np.uint8): (128.0, 1.0 / 128.0),
+}
+
+# soundfile（libsndfile）がメモリ上のデータから直接読める形式
+_SOUNDFILE_EXTENSIONS = frozenset({'.wav', '.flac', '.ogg', '.mp3'})
+
+# ユーザー音声と参照音声の読み込み・特徴量抽出を並行実行するためのスレッドプール
+# （libsndfile/FFT/NumPyはGILを解放するのでスレッドで並列化できる）
+_POOL = ThreadPoolExecutor(max_workers=4)
+
+# 参照音声の特徴量ディスクキャッシュのバージョン（extract_featuresの処理を変えたら上げる）
+FEATURE_CACHE_VERSION = 1
+
+# ユーザー音声の特徴量キャッシュの最大件数（同じ録音を別のレベルで再評価する場合に使う）
+_USER_FEATURE_CACHE_SIZE = 256
+
+# 総合評価の閾値（昇順）と、各区間に対応する（評価, メッセージ, 絵文字）
+_OVERALL_THRESHOLDS = (30, 50, 70, 85)
+_OVERALL_RATINGS = (
+    ("不合格", "❌ 発音が大きく異なります。参照音声をよく聞いて、繰り返し練習してください。", "😢"),
+    ("要改善", "💪 練習が必要です。下記のフィードバックに注意してください。", "😓"),
+    ("まあまあ", "📝 まあまあの発音です。下記の詳細を参考に改善しましょう。", "🤔"),
+    ("良い", "👍 良い発音です！この調子で練習を続けましょう。", "😊"),
+    ("素晴らしい", "✨ 素晴らしい発音です！ネイティブに近い発音ができています。", "🌟"),
+)
+
+# 各項目（ピッチ・タイミング・音量）の閾値（昇順）と、各区間のコメント
+# コメントは（参照より低い/短い/小さい場合, 参照より高い/長い/大きい場合）の組
+_ASPECT_THRESHOLDS = (50, 70)
+_PITCH_COMMENTS = (
+    ("❌ ピッチが違います。声が低すぎます。参照音声のように高く話してください。",
+     "❌ ピッチが違います。声が高すぎます。参照音声のように低く話してください。"),
+    ("⚠️ ピッチが少し低めです。もう少し高く話してみましょう。",
+     "⚠️ ピッチが少し高めです。もう少し低く話してみましょう。"),
+    ("✅ ピッチが良いです！", "✅ ピッチが良いです！"),
+)
+_TIMING_COMMENTS = (
+    ("❌ タイミングが違います。かなり早口です。参照音声のようにゆっくり話してください。",
+     "❌ タイミングが違います。かなりゆっくり話しています。参照音声のペースに合わせてください。"),
+    ("⚠️ 少し早口です。もう少しゆっくり話してみましょう。",
+     "⚠️ 少しゆっくり話しています。ネイティブのペースに合わせてみましょう。"),
+    ("✅ タイミングが素晴らしいです！", "✅ タイミングが素晴らしいです！"),
+)
+_VOLUME_COMMENTS = (
+    ("❌ 音量が違います。声が小さすぎます。参照音声のようにはっきりと話してください。",
+     "❌ 音量が違います。声が大きすぎます。参照音声のように小さな声で話してください。"),
+    ("⚠️ もう少し大きな声ではっきりと話してみましょう。",
+     "⚠️ もう少し小さな声で話してみましょう。"),
+    ("✅ 音量が良いです！", "✅ 音量が良いです！"),
+)
+
+
+# フィードバックの評価項目（項目名, 特徴量のキー, コメント表）
+_FEEDBACK_ASPECTS = (
+    ("ピッチ", 'pitch_mean', _PITCH_COMMENTS),
+    ("タイミング", 'duration', _TIMING_COMMENTS),
+    ("音量", 'rms_mean', _VOLUME_COMMENTS),
+)
+
+
+# DTW距離から類似度スコアへの対応表（区間ごとに線形補間）
+# 距離が小さいほど類似度が高い
+# 優しめの基準:
+# - 素晴らしい: 3000以下 → 85-100点
+# - 良い: 3000-8000 → 70-85点
+# - まあまあ: 8000-15000 → 55-70点
+# - 要改善: 15000-25000 → 40-55点
+# - もう少し: 25000-40000 → 25-40点
+# - 頑張ろう: 40000以上 → 20-25点（90000以上は20点）
+_SCORE_DISTANCES = np.array([0.0, 3000.0, 8000.0, 15000.0, 25000.0, 40000.0, 90000.0])
+_SCORE_POINTS = np.array([100.0, 85.0, 70.0, 55.0, 40.0, 25.0, 20.0])
+
+# この距離以上はスコアが下限（20点）に張り付くため、正確なDTWを計算する必要がない
+_DTW_FLOOR_DISTANCE = float(_SCORE_DISTANCES[-1])
+
+# DTWの到達不能セルを表す番兵（fastmathはinfを仮定しないため有限値を使う）
+_DTW_INF = 1e18
+
+
+@njit(cache=True, fastmath=True, boundscheck=False, nogil=True)
+def _banded_dtw(cost: np.ndarray, window: int) -> float:
+    """
+    Sakoe-Chiba帯域付きの厳密なDTW距離を計算（GILを解放するので複数スレッドから並列に呼べる）
+
+    Parameters:
+    - cost: 局所コスト行列（T_user × T_reference）
+    - window: 対角線からの許容幅（フレーム数）
+
+    Returns:
+    - distance: 最適経路上のコストの総和
+    """
+    n, m = cost.shape
+    slope = (m - 1) / (n - 1) if n > 1 else 0.0
+
+    # DPテーブルは2行分のみ保持（インデックス0は番兵）
+    prev = np.full(m + 1, _DTW_INF)
+    curr = np.full(m + 1, _DTW_INF)
+    prev[0] = 0.0
+
+    for i in range(n):
+        center = i * slope
+        lo = max(0, int(np.ceil(center - window)))
+        hi = min(m - 1, int(np.floor(center + window)))
+        curr[:] = _DTW_INF
+        for j in range(lo, hi + 1):
+            best = prev[j + 1]
+            if curr[j] < best:
+                best = curr[j]
+            if prev[j] < best:
+                best = prev[j]
+            curr[j + 1] = cost[i, j] + best
+        prev, curr = curr, prev
+        prev[0] = _DTW_INF
+
+    return prev[m]
+
+
+@njit(cache=True)
+def _distance_to_score(distance: float) -> float:
+    """
+    DTW距離を類似度スコア（20-100）に変換
+    
+    Parameters:
+    - distance: DTW距離
+    
+    Returns:
+    - similarity_score: 類似度スコア
+    """
+    return np.interp(distance, _SCORE_DISTANCES, _SCORE_POINTS)
+
+
+def _lb_keogh(user_frames: np.ndarray, reference_frames: np.ndarray, window: int) -> float:
+    """
+    帯域付きDTW距離の下限（LB_Keogh）を計算
+    
+    各ユーザーフレームは帯域内のどれかの参照フレームと必ず対応付くので、
+    帯域内の参照フレームの上下包絡線までの距離の総和はDTW距離以下になる
+    
+    Parameters:
+    - user_frames: ユーザー音声のフレーム列（T_user × 次元数）
+    - reference_frames: 参照音声のフレーム列（T_reference × 次元数）
+    - window: DTWの帯域幅（フレーム数）
+    
+    Returns:
+    - lower_bound: DTW距離の下限
+    """
+    n, m = len(user_frames), len(reference_frames)
+    slope = (m - 1) / (n - 1) if n > 1 else 0.0
+    
+    # 帯域の中心を丸めても帯域全体を覆うよう、1フレーム広げた包絡線を使う
+    size = 2 * (window + 1) + 1
+    upper = maximum_filter1d(reference_frames, size=size, axis=0, mode='nearest')
+    lower = minimum_filter1d(reference_frames, size=size, axis=0, mode='nearest')
+    centers = np.clip(np.rint(np.arange(n) * slope).astype(np.int64), 0, m - 1)
+    
+    above = np.maximum(user_frames - upper[centers], 0)
+    below = np.maximum(lower[centers] - user_frames, 0)
+    return float(np.sqrt((above * above + below * below).sum(axis=1)).sum())
+
+
+def _frame_distances(user_frames: np.ndarray, reference_frames: np.ndarray) -> np.ndarray:
+    """
+    フレーム間のユークリッド距離行列を計算
+    
+    Parameters:
+    - user_frames: ユーザー音声のフレーム列（T_user × 次元数）
+    - reference_frames: 参照音声のフレーム列（T_reference × 次元数）
+    
+    Returns:
+    - cost: 距離行列（T_user × T_reference）
+    """
+    if simsimd is not None:
+        # 両方の系列に共通のスケールでint8に量子化（距離のスケールを保つため）
+        scale = max(np.abs(user_frames).max(), np.abs(reference_frames).max()) / 127.0
+        if scale == 0:
+            scale = 1.0
+        user_q8 = _quantize_int8(user_frames, scale)
+        reference_q8 = _quantize_int8(reference_frames, scale)
+        sq_dist = np.asarray(simsimd.cdist(user_q8, reference_q8, metric='sqeuclidean', out_dtype='float32'))
+        return np.sqrt(sq_dist) * np.float32(scale)
+    return cdist(user_frames, reference_frames, 'euclidean')
+
+
+def _mean_pool(frames: np.ndarray, size: int) -> np.ndarray:
+    """
+    時間軸方向にsize個ずつのフレームを平均して縮約（末尾の端数は1つにまとめる）
+    
+    Parameters:
+    - frames: フレーム列（T × 次元数）
+    - size: 1つにまとめるフレーム数
+    
+    Returns:
+    - pooled: 縮約後のフレーム列（ceil(T / size) × 次元数）
+    """
+    full = (len(frames) // size) * size
+    pooled = frames[:full].reshape(-1, size, frames.shape[1]).mean(axis=1)
+    if full < len(frames):
+        pooled = np.vstack([pooled, frames[full:].mean(axis=0, keepdims=True)])
+    return pooled
+
+
+def _quantize_int8(frames: np.ndarray, scale: float) -> np.ndarray:
+    """
+    フレーム列を指定スケールでint8に量子化
+    
+    Parameters:
+    - frames: フレーム列（T × 次元数）
+    - scale: 1ステップあたりの値
+    
+    Returns:
+    - quantized: C連続のint8配列
+    """
+    quantized = np.clip(np.rint(frames / scale), -127, 127).astype(np.int8)
+    return np.ascontiguousarray(quantized)
+
+
+def _mean_std(values: np.ndarray, axis: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    平均と標準偏差を1回の走査で計算（Var = E[X²] - E[X]²）
+    
+    Parameters:
+    - values: 入力配列
+    - axis: 集計する軸（Noneの場合は全要素）
+    
+    Returns:
+    - mean: 平均
+    - std: 標準偏差
+    """
+    count = values.size if axis is None else values.shape[axis]
+    # 桁落ちを避けるためfloat64で累積
+    total = values.sum(axis=axis, dtype=np.float64)
+    total_sq = np.square(values, dtype=np.float64).sum(axis=axis)
+    mean = total / count
+    std = np.sqrt(np.maximum(total_sq / count - mean * mean, 0.0))
+    return mean, std
+
+
+@njit(cache=True, nogil=True)
+def _frame_summary(audio_data: np.ndarray, frame_length: int, hop_length: int) -> Tuple[float, float, float]:
+    """
+    ゼロ交差率の平均とRMSの平均・標準偏差を1回のフレーム走査でまとめて計算
+
+    librosa.feature.zero_crossing_rate（端の値でパディング）と
+    librosa.feature.rms（ゼロでパディング）のcenter=Trueと同じフレーム分割で計算する
+
+    Parameters:
+    - audio_data: 音声データ
+    - frame_length: フレーム長
+    - hop_length: ホップ長
+
+    Returns:
+    - zcr_mean: ゼロ交差率の平均
+    - rms_mean: RMSの平均
+    - rms_std: RMSの標準偏差
+    """
+    n = len(audio_data)
+    if n == 0:
+        return 0.0, 0.0, 0.0
+
+    half = frame_length // 2
+    n_frames = 1 + (n + 2 * half - frame_length) // hop_length
+    threshold = 1e-10
+
+    zcr_total = 0.0
+    rms_total = 0.0
+    rms_sq_total = 0.0
+    for t in range(n_frames):
+        start = t * hop_length - half
+        crossings = 0
+        power = 0.0
+        previous = False
+        for j in range(start, start + frame_length):
+            # RMSはフレーム外をゼロとして扱う
+            if 0 <= j < n:
+                power += float(audio_data[j]) * float(audio_data[j])
+            # ゼロ交差は端の値で延長し、閾値以下の値は0（正）として扱う
+            value = audio_data[min(max(j, 0), n - 1)]
+            negative = value < -threshold
+            if j > start and negative != previous:
+                crossings += 1
+            previous = negative
+        rms = np.sqrt(power / frame_length)
+        zcr_total += crossings / frame_length
+        rms_total += rms
+        rms_sq_total += rms * rms
+
+    rms_mean = rms_total / n_frames
+    rms_std = np.sqrt(max(rms_sq_total / n_frames - rms_mean * rms_mean, 0.0))
+    return zcr_total / n_frames, rms_mean, rms_std
+
+
+class GPUSpectrogramExtractor:
+    """
+    torchを使ってGPU上でパワースペクトログラムを一括計算するクラス
+    
+    librosa.stftと同じ設定（hann窓、center=True、ゼロパディング）で計算するため、
+    メルフィルタバンク以降の処理はCPU版と共通のまま使える
+    """
+    
+    def __init__(self, n_fft: int, hop_length: int, device: str = "cuda"):
+        """
+        Parameters:
+        - n_fft: FFT長
+        - hop_length: ホップ長
+        - device: 計算に使うデバイス
+        """
+        import torch
+        
+        self.torch = torch
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.device = torch.device(device)
+        self.window = torch.hann_window(n_fft, periodic=True, device=self.device)
+    
+    @staticmethod
+    def is_available() -> bool:
+        """torchがインストールされていてCUDAが使えるか"""
+        try:
+            import torch
+        except ImportError:
+            return False
+        return torch.cuda.is_available()
+    
+    def power_spectrograms(self, signals: List[np.ndarray]) -> List[np.ndarray]:
+        """
+        複数の音声のパワースペクトログラムを1回のcuFFTで計算
+        
+        Parameters:
+        - signals: 音声データのリスト
+        
+        Returns:
+        - spectrograms: 各音声のパワースペクトログラム（周波数 × フレーム）
+        """
+        torch = self.torch
+        lengths = [len(signal) for signal in signals]
+        
+        # 最長の音声に合わせてゼロパディングし、(B, T)にまとめる
+        batch = np.zeros((len(signals), max(lengths)), dtype=np.float32)
+        for i, signal in enumerate(signals):
+            batch[i, :len(signal)] = signal
+        
+        x = torch.from_numpy(batch).pin_memory().to(self.device, non_blocking=True)
+        spec = torch.stft(
+            x,
+            n_fft=self.n_fft,
+            hop_length=self.hop_length,
+            window=self.window,
+            center=True,
+            pad_mode='constant',
+            return_complex=True
+        )
+        power = (spec.abs() ** 2).cpu().numpy()
+        
+        # パディング分のフレームを除去
+        return [power[i, :, :1 + length // self.hop_length] for i, length in enumerate(lengths)]
 
 
 class AudioProcessor:
     """音声ファイルの処理と分析を行うクラス"""
     
-    def __init__(self, sample_rate: int = 22050):
+    def __init__(self, sample_rate: int = 16000):
         """
         Parameters:
-        - sample_rate: サンプリングレート（Hz）
+        - sample_rate: サンプリングレート（Hz）。音声は8kHz以下に情報が集中するため16kHzで十分
         """
         self.sample_rate = sample_rate
+        # 読み込む音声の最大長（秒）。長時間の録音でもメモリと処理時間を一定に抑える
+        self.max_duration_sec = 10.0
+        # MFCC用のSTFT設定・窓関数・メルフィルタバンク（呼び出しごとに作り直さない）
+        # DTWの閾値は22050Hz・hop 512（約23ms）で調整されているため、
+        # サンプリングレートに合わせて窓長とホップ長を換算し、時間分解能を揃える
+        self.hop_length = round(sample_rate * 512 / 22050)
+        self.n_fft = self.hop_length * 4
+        self.n_mfcc = 13
+        self._window = librosa.filters.get_window('hann', self.n_fft, fftbins=True)
+        self._mel_basis = librosa.filters.mel(sr=sample_rate, n_fft=self.n_fft)
+        self._fft_freqs = librosa.fft_frequencies(sr=sample_rate, n_fft=self.n_fft)
+        # CUDAが使える場合はSTFTをGPUで計算
+        self._gpu = GPUSpectrogramExtractor(self.n_fft, self.hop_length) if GPUSpectrogramExtractor.is_available() else None
+        # 参照音声の特徴量キャッシュ（キー: (パス, 更新時刻)）
+        self._ref_cache: Dict[Tuple[str, float], Dict] = {}
+        # ユーザー音声の特徴量キャッシュ（キー: 呼び出し側が計算した音声のハッシュ）
+        self._user_cache: "OrderedDict[str, Dict]" = OrderedDict()
+        self._user_cache_lock = threading.Lock()
+    
+    def can_load_from_memory(self, file_extension: str) -> bool:
+        """
+        この拡張子の音声をディスクに書き出さずに（BytesIOから）読み込めるか
+        """
+        return av is not None or file_extension in _SOUNDFILE_EXTENSIONS
     
-    def load_audio(self, file_path: str) -> Tuple[np.ndarray, int]:
+    def load_audio(self, file_path: Union[str, BinaryIO]) -> Tuple[np.ndarray, int]:
         """
         音声ファイルを読み込む
         
+        Parameters:
+        - file_path: 音声ファイルのパス、またはメモリ上の音声（BytesIOなど）
+        
         Returns:
         - audio_data: 音声データ（numpy配列）
         - sample_rate: サンプリングレート
         """
-        import warnings
-        warnings.filterwarnings('ignore')
+        logger.debug("load_audio呼び出し: file_path=%s, type=%s", file_path, type(file_path))
         
-        print(f"load_audio呼び出し: file_path={file_path}, type={type(file_path)}")
+        # メモリ上の音声はsoundfileで読み、読めない形式はPyAVでデコード
+        if hasattr(file_path, 'read'):
+            try:
+                return self._read_with_soundfile(file_path), self.sample_rate
+            except Exception as e:
+                if av is None:
+                    raise
+                logger.debug("soundfileで読めないためPyAVでデコード: %s", e)
+            file_path.seek(0)
+            return self._decode_with_av(file_path), self.sample_rate
         
         # ファイルの存在確認
         if not Path(file_path).exists():
@@ -40,115 +473,195 @@ class AudioProcessor:
         
         # ファイル拡張子を取得
         file_extension = Path(file_path).suffix.lower()
-        print(f"ファイル拡張子: {file_extension}")
+        logger.debug("ファイル拡張子: %s", file_extension)
+        
+        # 3GP/AMRファイルの場合、PyAVでプロセス内デコード（一時ファイル・子プロセスなし）
+        if file_extension in ['.3gp', '.amr'] and av is not None:
+            try:
+                audio_data = self._decode_with_av(file_path)
+                logger.debug("PyAVデコード成功: %d samples", len(audio_data))
+                return audio_data, self.sample_rate
+            except Exception as e:
+                logger.warning("PyAVデコードエラー: %s。FFmpegで試します。", e)
         
-        # 3GP/AMRファイルの場合、FFmpegで変換
+        # PyAVが使えない場合はFFmpegで変換
         if file_extension in ['.3gp', '.amr']:
             try:
                 import subprocess
-                import tempfile
-                import os
                 
-                print(f"3GP/AMRファイルを変換中: {file_path}")
+                logger.info("3GP/AMRファイルを変換中: %s", file_path)
                 
-                # 一時WAVファイルを作成
-                temp_wav = tempfile.mktemp(suffix='.wav')
-                
-                # FFmpegで変換（より堅牢な方法）
+                # FFmpegでモノラル・float32のPCMに変換し、標準出力から直接受け取る（一時ファイルなし）
                 try:
                     result = subprocess.run([
                         'ffmpeg', '-i', file_path,
+                        '-t', str(self.max_duration_sec),
+                        '-f', 'f32le',
                         '-ar', str(self.sample_rate),
                         '-ac', '1',
-                        '-y',
-                        temp_wav
-                    ], check=True, capture_output=True, text=True, timeout=30)
-                    print(f"FFmpeg変換成功")
+                        '-'
+                    ], check=True, capture_output=True, timeout=30)
+                    audio_data = np.frombuffer(result.stdout, dtype=np.float32).copy()
+                    logger.debug("FFmpeg変換成功")
                 except subprocess.CalledProcessError as e:
-                    print(f"FFmpeg変換エラー: {e.stderr}")
-                    raise Exception(f"FFmpeg conversion failed: {e.stderr}")
+                    stderr = e.stderr.decode(errors='replace')
+                    logger.warning("FFmpeg変換エラー: %s", stderr)
+                    raise Exception(f"FFmpeg conversion failed: {stderr}")
                 except FileNotFoundError:
-                    print("FFmpegが見つかりません。pydubで試します。")
-                    # pydubで変換を試みる
+                    logger.warning("FFmpegが見つかりません。pydubで試します。")
+                    # pydubで変換を試みる（16bit PCMのサンプル列をそのまま取り出す）
                     from pydub import AudioSegment
-                    audio = AudioSegment.from_file(file_path)
+                    audio = AudioSegment.from_file(file_path)[:int(self.max_duration_sec * 1000)]
                     audio = audio.set_channels(1)
                     audio = audio.set_frame_rate(self.sample_rate)
-                    audio.export(temp_wav, format="wav")
-                    print(f"pydub変換成功")
-                
-                # WAVファイルを読み込み
-                audio_data, sr = librosa.load(temp_wav, sr=self.sample_rate, mono=True)
-                
-                # 一時ファイルを削除
-                if os.path.exists(temp_wav):
-                    os.remove(temp_wav)
+                    audio = audio.set_sample_width(2)
+                    audio_data = np.frombuffer(audio.raw_data, dtype=np.int16).astype(np.float32) / 32768.0
+                    logger.debug("pydub変換成功")
                 
-                print(f"3GP/AMR変換成功: {len(audio_data)} samples")
-                return audio_data, sr
+                logger.debug("3GP/AMR変換成功: %d samples", len(audio_data))
+                return audio_data, self.sample_rate
                 
             except Exception as e:
-                print(f"Error converting 3GP/AMR: {e}")
-                import traceback
-                print(traceback.format_exc())
+                logger.exception("Error converting 3GP/AMR: %s", e)
                 raise Exception(f"Failed to convert 3GP/AMR file: {str(e)}")
         
-        # WAVファイルの場合、scipyで試す（軽量）
+        # まずsoundfileで直接読み込み（WAV, FLAC, OGG, MP3など。librosaを経由しない最速の経路）
+        try:
+            return self._read_with_soundfile(file_path), self.sample_rate
+        except Exception as e:
+            logger.warning("soundfile読み込みエラー: %s", e)
+            soundfile_error = e
+            # 次の方法にフォールバック
+        
+        # WAVファイルの場合、scipyで試す
         if file_extension == '.wav':
             try:
+                # scipy.ioはこのフォールバックでしか使わないので、ここで初めて読み込む
                 from scipy.io import wavfile
-                sr, audio_data = wavfile.read(file_path)
-                print(f"scipy読み込み成功: sr={sr}, shape={audio_data.shape}, dtype={audio_data.dtype}")
                 
-                # 正規化
-                if audio_data.dtype == np.int16:
-                    audio_data = audio_data.astype(np.float32) / 32768.0
-                elif audio_data.dtype == np.int32:
-                    audio_data = audio_data.astype(np.float32) / 2147483648.0
-                elif audio_data.dtype == np.uint8:
-                    audio_data = (audio_data.astype(np.float32) - 128) / 128.0
+                # メモリマップで開き、必要な先頭部分だけを読み出す
+                sr, raw = wavfile.read(file_path, mmap=True)
+                raw = raw[:int(self.max_duration_sec * sr)]
+                logger.debug("scipy読み込み成功: sr=%s, shape=%s, dtype=%s", sr, raw.shape, raw.dtype)
+                
+                # 正規化（整数PCMはオフセットと倍率で[-1, 1]に、浮動小数点WAVはそのままfloat32に揃える）
+                # np.arrayでコピーし、メモリマップへの参照を残さない
+                audio_data = np.array(raw, dtype=np.float32)
+                offset, scale = _WAV_NORMALIZATION.get(raw.dtype, (0.0, 1.0))
+                if offset:
+                    audio_data -= offset
+                if scale != 1.0:
+                    audio_data *= scale
                 
                 # モノラルに変換
                 if len(audio_data.shape) > 1:
-                    audio_data = np.mean(audio_data, axis=1)
+                    audio_data = audio_data.mean(axis=1, dtype=np.float32)
                 
                 # リサンプリング
                 if sr != self.sample_rate:
-                    audio_data = librosa.resample(audio_data, orig_sr=sr, target_sr=self.sample_rate)
+                    audio_data = self._resample(audio_data, sr)
                 
-                print(f"scipy処理完了: 最終shape={audio_data.shape}")
+                logger.debug("scipy処理完了: 最終shape=%s", audio_data.shape)
                 return audio_data, self.sample_rate
             except Exception as e:
-                print(f"scipy読み込みエラー: {e}")
+                logger.warning("scipy読み込みエラー: %s", e)
                 # 次の方法にフォールバック
         
-        # MP3, M4A, OGG, FLACなどの場合、soundfileまたはlibrosaで読み込み
+        # 最終フォールバック：librosaで読み込み（M4Aなど。最も汎用的だが遅い）
         try:
-            import soundfile as sf
-            audio_data, sr = sf.read(file_path, dtype='float32')
-            print(f"soundfile読み込み成功: sr={sr}, shape={audio_data.shape}")
-            
-            # モノラルに変換
-            if len(audio_data.shape) > 1:
-                audio_data = np.mean(audio_data, axis=1)
-            
-            # リサンプリング
-            if sr != self.sample_rate:
-                audio_data = librosa.resample(audio_data, orig_sr=sr, target_sr=self.sample_rate)
-            
-            print(f"soundfile処理完了: 最終shape={audio_data.shape}")
+            audio_data, sr = librosa.load(file_path, sr=self.sample_rate, mono=True, duration=self.max_duration_sec)
+            logger.debug("librosa読み込み成功: shape=%s", audio_data.shape)
             return audio_data, self.sample_rate
-        except Exception as e:
-            print(f"soundfile読み込みエラー: {e}")
-            
-            # 最終フォールバック：librosaで読み込み（最も汎用的だが遅い）
-            try:
-                audio_data, sr = librosa.load(file_path, sr=self.sample_rate, mono=True)
-                print(f"librosa読み込み成功: shape={audio_data.shape}")
-                return audio_data, self.sample_rate
-            except Exception as e2:
-                print(f"librosa読み込みエラー: {e2}")
-                raise Exception(f"Could not load audio file with any method. File: {file_path}, Extension: {file_extension}. Errors: {str(e)}, {str(e2)}")
+        except Exception as e2:
+            logger.warning("librosa読み込みエラー: %s", e2)
+            raise Exception(f"Could not load audio file with any method. File: {file_path}, Extension: {file_extension}. Errors: {str(soundfile_error)}, {str(e2)}")
+    
+    def _read_with_soundfile(self, file_path: Union[str, BinaryIO]) -> np.ndarray:
+        """
+        soundfileで音声を読み込み、モノラル・self.sample_rateのfloat32配列にする
+        
+        Parameters:
+        - file_path: 音声ファイルのパス、またはメモリ上の音声
+        
+        Returns:
+        - audio_data: 音声データ
+        """
+        # 先頭max_duration_sec秒分のフレームだけを読み込む（ファイル全体をメモリに載せない）
+        with sf.SoundFile(file_path) as f:
+            sr = f.samplerate
+            audio_data = f.read(int(self.max_duration_sec * sr), dtype='float32', always_2d=False)
+        logger.debug("soundfile読み込み成功: sr=%s, shape=%s", sr, audio_data.shape)
+        
+        # モノラルに変換
+        if audio_data.ndim > 1:
+            audio_data = audio_data.mean(axis=1, dtype=np.float32)
+        
+        # リサンプリング
+        if sr != self.sample_rate:
+            audio_data = self._resample(audio_data, sr)
+        
+        logger.debug("soundfile処理完了: 最終shape=%s", audio_data.shape)
+        return audio_data
+    
+    def _decode_with_av(self, file_path: Union[str, BinaryIO]) -> np.ndarray:
+        """
+        PyAV（libav）で音声をデコードし、モノラル・self.sample_rateのfloat32配列にする
+        
+        Parameters:
+        - file_path: 音声ファイルのパス、またはメモリ上の音声
+        
+        Returns:
+        - audio_data: 音声データ
+        """
+        resampler = av.AudioResampler(format='flt', layout='mono', rate=self.sample_rate)
+        max_samples = int(self.max_duration_sec * self.sample_rate)
+        chunks = []
+        decoded = 0
+        with av.open(file_path) as container:
+            stream = container.streams.audio[0]
+            for frame in container.decode(stream):
+                for resampled in resampler.resample(frame):
+                    chunk = resampled.to_ndarray().ravel()
+                    chunks.append(chunk)
+                    decoded += len(chunk)
+                # 最大長に達したら残りはデコードしない
+                if decoded >= max_samples:
+                    break
+            # リサンプラーに残ったサンプルを取り出す
+            for resampled in resampler.resample(None):
+                chunks.append(resampled.to_ndarray().ravel())
+        
+        if not chunks:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(chunks)[:max_samples]
+    
+    def _resample(self, audio_data: np.ndarray, orig_sr: int) -> np.ndarray:
+        """
+        self.sample_rateにリサンプリング
+        
+        librosa.resampleと同じsoxr（HQ）を直接呼び出す。
+        scipyのresample_polyは44.1k/48k/16k/8kいずれでもsoxrより2〜3倍遅かった。
+        
+        Parameters:
+        - audio_data: 音声データ
+        - orig_sr: 元のサンプリングレート
+        
+        Returns:
+        - audio_data: リサンプリング後の音声データ
+        """
+        resampled = soxr.resample(audio_data, orig_sr, self.sample_rate, quality='HQ')
+        return resampled.astype(np.float32, copy=False)
+    
+    def power_spectrogram(self, audio_data: np.ndarray) -> np.ndarray:
+        """
+        パワースペクトログラムを計算（GPUが使える場合はGPUで計算）
+        
+        Returns:
+        - power_spec: パワースペクトログラム（周波数 × フレーム）
+        """
+        if self._gpu is not None:
+            return self._gpu.power_spectrograms([audio_data])[0]
+        return np.abs(librosa.stft(audio_data, n_fft=self.n_fft, hop_length=self.hop_length, window=self._window)) ** 2
     
     def extract_features(self, audio_data: np.ndarray) -> Dict:
         """
@@ -159,43 +672,197 @@ class AudioProcessor:
         """
         features = {}
         
+        # 以降の特徴量計算をすべてfloat32で行う（float64への昇格を防ぐ）
+        audio_data = np.asarray(audio_data, dtype=np.float32)
+        
         # MFCC (Mel-frequency cepstral coefficients)
-        mfcc = librosa.feature.mfcc(y=audio_data, sr=self.sample_rate, n_mfcc=13)
+        # STFTは1回だけ計算し、MFCC・ピッチ・スペクトル重心で共有
+        power_spec = self.power_spectrogram(audio_data)
+        magnitude_spec = np.sqrt(power_spec)
+        mel_spec = self._mel_basis @ power_spec
+        mfcc = librosa.feature.mfcc(S=librosa.power_to_db(mel_spec), n_mfcc=self.n_mfcc)
         features['mfcc'] = mfcc
-        features['mfcc_mean'] = np.mean(mfcc, axis=1)
-        features['mfcc_std'] = np.std(mfcc, axis=1)
+        features['mfcc_mean'], features['mfcc_std'] = _mean_std(mfcc, axis=1)
         
         # ピッチ（基本周波数）
-        pitches, magnitudes = librosa.piptrack(y=audio_data, sr=self.sample_rate)
-        pitch_values = []
-        for t in range(pitches.shape[1]):
-            index = magnitudes[:, t].argmax()
-            pitch = pitches[index, t]
-            if pitch > 0:
-                pitch_values.append(pitch)
-        
-        features['pitch_mean'] = float(np.mean(pitch_values)) if pitch_values else 0.0
-        features['pitch_std'] = float(np.std(pitch_values)) if pitch_values else 0.0
-        
-        # スペクトル重心
-        spectral_centroids = librosa.feature.spectral_centroid(y=audio_data, sr=self.sample_rate)[0]
-        features['spectral_centroid_mean'] = float(np.mean(spectral_centroids))
-        features['spectral_centroid_std'] = float(np.std(spectral_centroids))
-        
-        # ゼロ交差率
-        zero_crossing_rate = librosa.feature.zero_crossing_rate(audio_data)[0]
-        features['zero_crossing_rate_mean'] = float(np.mean(zero_crossing_rate))
-        
-        # RMS エネルギー
-        rms = librosa.feature.rms(y=audio_data)[0]
-        features['rms_mean'] = float(np.mean(rms))
-        features['rms_std'] = float(np.std(rms))
+        pitches, magnitudes = librosa.piptrack(S=magnitude_spec, sr=self.sample_rate)
+        # 各フレームで最大振幅のビンのピッチを一括で取り出す
+        index = magnitudes.argmax(axis=0)
+        pitch_values = pitches[index, np.arange(pitches.shape[1])]
+        pitch_values = pitch_values[pitch_values > 0]
+        
+        pitch_mean, pitch_std = _mean_std(pitch_values) if pitch_values.size else (0.0, 0.0)
+        features['pitch_mean'] = float(pitch_mean)
+        features['pitch_std'] = float(pitch_std)
+        
+        # スペクトル重心（各フレームの振幅で重み付けした周波数の平均。無音フレームは0）
+        magnitude_sum = magnitude_spec.sum(axis=0)
+        spectral_centroids = (self._fft_freqs @ magnitude_spec) / np.where(magnitude_sum > 0, magnitude_sum, 1.0)
+        centroid_mean, centroid_std = _mean_std(spectral_centroids)
+        features['spectral_centroid_mean'] = float(centroid_mean)
+        features['spectral_centroid_std'] = float(centroid_std)
+        
+        # ゼロ交差率とRMS エネルギー（波形を1回走査してまとめて集計）
+        # RMSはS=から計算すると窓関数の分だけ値が小さくなり無音判定の閾値がずれるため、波形から計算
+        zcr_mean, rms_mean, rms_std = _frame_summary(audio_data, 2048, 512)
+        features['zero_crossing_rate_mean'] = float(zcr_mean)
+        features['rms_mean'] = float(rms_mean)
+        features['rms_std'] = float(rms_std)
         
         # 音声の長さ
         features['duration'] = float(len(audio_data) / self.sample_rate)
         
         return features
     
+    def get_reference_features(self, reference_audio_path: str) -> Dict:
+        """
+        参照音声の特徴量を取得（メモリとディスクにキャッシュ）
+        
+        参照音声は固定なので、一度抽出した特徴量を
+        reference_audio/.cache/ にファイル内容のハッシュをキーとして保存し再利用する
+        （デプロイなどで更新時刻が変わってもキャッシュが有効なまま）
+        
+        Parameters:
+        - reference_audio_path: 参照音声のパス
+        
+        Returns:
+        - features: 抽出された特徴量の辞書
+        """
+        path = Path(reference_audio_path)
+        mtime = path.stat().st_mtime
+        key = (str(path), mtime)
+        
+        cached = self._ref_cache.get(key)
+        if cached is not None:
+            return cached
+        
+        digest = hashlib.blake2b(path.read_bytes(), digest_size=16).hexdigest()
+        cache_dir = path.parent / ".cache"
+        # 抽出の設定が変わったら別のキャッシュになるよう、設定とバージョンをファイル名に含める
+        cache_name = (
+            f"{digest}_v{FEATURE_CACHE_VERSION}_{self.sample_rate}"
+            f"_{self.n_mfcc}_{self.n_fft}_{self.hop_length}"
+        )
+        mfcc_path = cache_dir / f"{cache_name}.mfcc.npy"
+        meta_path = cache_dir / f"{cache_name}.json"
+        
+        features = None
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            features = dict(meta["features"])
+            features['mfcc'] = np.load(mfcc_path, mmap_mode='r')
+            features['mfcc_mean'] = np.array(features['mfcc_mean'])
+            features['mfcc_std'] = np.array(features['mfcc_std'])
+            logger.debug("参照特徴量キャッシュ読み込み: %s (%s)", meta_path, path.name)
+        except (OSError, ValueError, KeyError):
+            features = None
+        
+        if features is None:
+            reference_audio, _ = self.load_audio(reference_audio_path)
+            features = self.extract_features(reference_audio)
+            
+            try:
+                cache_dir.mkdir(exist_ok=True)
+                scalars = {k: v for k, v in features.items() if k != 'mfcc'}
+                scalars['mfcc_mean'] = features['mfcc_mean'].tolist()
+                scalars['mfcc_std'] = features['mfcc_std'].tolist()
+                # 他のワーカーがmmapで読んでいるファイルを書き換えないよう、
+                # 一時ファイルに書いてから置き換える（.jsonがあれば.npyも揃っているよう、.npyを先に置く）
+                temp_suffix = f".{uuid.uuid4().hex}.tmp"
+                mfcc_temp = mfcc_path.with_name(mfcc_path.name + temp_suffix)
+                with open(mfcc_temp, "wb") as f:
+                    np.save(f, features['mfcc'])
+                os.replace(mfcc_temp, mfcc_path)
+                meta_temp = meta_path.with_name(meta_path.name + temp_suffix)
+                meta_temp.write_text(json.dumps({
+                    "source": path.name,
+                    "sample_rate": self.sample_rate,
+                    "features": scalars
+                }), encoding="utf-8")
+                os.replace(meta_temp, meta_path)
+            except OSError as e:
+                logger.warning("参照特徴量キャッシュ保存エラー: %s", e)
+        
+        self._ref_cache[key] = features
+        return features
+    
+    def get_user_features(
+        self,
+        user_audio_path: Union[str, BinaryIO],
+        user_audio_key: Optional[str] = None
+    ) -> Dict:
+        """
+        ユーザー音声の特徴量を取得（キーを指定した場合は直近の結果をメモリにキャッシュ）
+        
+        特徴量はレベルに依存しないので、同じ録音を別のレベルで評価する場合は再抽出しない
+        
+        Parameters:
+        - user_audio_path: ユーザー音声のパス、またはメモリ上の音声（BytesIOなど）
+        - user_audio_key: 音声内容のハッシュ（Noneの場合はキャッシュしない）
+        
+        Returns:
+        - features: 抽出された特徴量の辞書
+        """
+        if user_audio_key is not None:
+            with self._user_cache_lock:
+                cached = self._user_cache.get(user_audio_key)
+                if cached is not None:
+                    self._user_cache.move_to_end(user_audio_key)
+                    return cached
+        
+        user_audio, _ = self.load_audio(user_audio_path)
+        features = self.extract_features(user_audio)
+        
+        if user_audio_key is not None:
+            with self._user_cache_lock:
+                self._user_cache[user_audio_key] = features
+                if len(self._user_cache) > _USER_FEATURE_CACHE_SIZE:
+                    self._user_cache.popitem(last=False)
+        return features
+    
+    def preload_references(self, paths: List[str]) -> int:
+        """
+        参照音声の特徴量を事前に計算してキャッシュ（サーバー起動時用）
+        
+        デコードとSTFTはGILを解放するため、スレッドプールで並列に抽出する
+        （特徴量はこのプロセスのキャッシュに入れる必要があるのでプロセスは使わない）
+        
+        Parameters:
+        - paths: 参照音声のパスのリスト
+        
+        Returns:
+        - loaded: キャッシュできたファイル数
+        """
+        futures = {path: _POOL.submit(self.get_reference_features, path) for path in paths}
+        loaded = 0
+        for path, future in futures.items():
+            try:
+                future.result()
+                loaded += 1
+            except Exception as e:
+                logger.warning("参照特徴量の事前計算エラー: %s: %s", path, e)
+        
+        logger.info("参照特徴量を事前計算: %d/%d件", loaded, len(paths))
+        return loaded
+    
+    def warm_up(self):
+        """
+        短い合成音で読み込みから比較までを一通り実行する（サーバー起動時用）
+        
+        numbaカーネルのキャッシュ読み込みやlibrosa・scipy内部の初期化を起動時に済ませ、
+        最初のリクエストだけが遅くなるのを防ぐ
+        """
+        t = np.arange(self.sample_rate // 2) / self.sample_rate
+        tone = (0.3 * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+        buffer = io.BytesIO()
+        sf.write(buffer, tone, self.sample_rate, format='WAV')
+        buffer.seek(0)
+        
+        audio_data, _ = self.load_audio(buffer)
+        features = self.extract_features(audio_data)
+        self._compare_features(features, features, "beginner")
+        logger.info("音声処理のウォームアップ完了")
+    
     def analyze_pronunciation(self, file_path: str) -> Dict:
         """
         発音を分析して評価を返す
@@ -242,71 +909,146 @@ class AudioProcessor:
         user_mfcc_t = user_mfcc.T
         reference_mfcc_t = reference_mfcc.T
         
-        # DTWで距離を計算
-        distance, _ = fastdtw(user_mfcc_t, reference_mfcc_t, dist=euclidean)
+        # 長い録音は時間軸を平均プーリングで縮約する（距離は経路長に比例するので縮約率を掛けて戻す）
+        step = -(-max(len(user_mfcc_t), len(reference_mfcc_t)) // MAX_DTW_FRAMES)
+        if step > 1:
+            user_mfcc_t = _mean_pool(user_mfcc_t, step)
+            reference_mfcc_t = _mean_pool(reference_mfcc_t, step)
+            logger.debug("DTW用にMFCCを1/%dにプーリング", step)
         
-        print(f"DTW距離: {distance}")
+        # 距離計算が行を連続アクセスできるよう、C連続のfloat32配列にまとめる
+        user_mfcc_t = np.ascontiguousarray(user_mfcc_t, dtype=np.float32)
+        reference_mfcc_t = np.ascontiguousarray(reference_mfcc_t, dtype=np.float32)
         
-        # 距離を類似度スコアに変換（0-100の範囲）
-        # 距離が小さいほど類似度が高い
-        # 優しめの基準:
-        # - 素晴らしい: 3000以下 → 85-100点
-        # - 良い: 3000-8000 → 70-85点
-        # - まあまあ: 8000-15000 → 55-70点
-        # - 要改善: 15000-25000 → 40-55点
-        # - もう少し: 25000-40000 → 25-40点
-        # - 頑張ろう: 40000以上 → 20-25点
-        
-        if distance < 3000:
-            # 素晴らしい発音（ネイティブに近い）
-            similarity_score = 85 + (1 - distance / 3000) * 15
-        elif distance < 8000:
-            # 良い発音
-            similarity_score = 70 + (1 - (distance - 3000) / 5000) * 15
-        elif distance < 15000:
-            # まあまあ
-            similarity_score = 55 + (1 - (distance - 8000) / 7000) * 15
-        elif distance < 25000:
-            # 要改善
-            similarity_score = 40 + (1 - (distance - 15000) / 10000) * 15
-        elif distance < 40000:
-            # もう少し
-            similarity_score = 25 + (1 - (distance - 25000) / 15000) * 15
+        window = max(abs(len(user_mfcc_t) - len(reference_mfcc_t)), 10)
+        
+        # 下限だけでスコアが下限点に確定する場合はDTWを省略
+        lower_bound = _lb_keogh(user_mfcc_t, reference_mfcc_t, window) * step
+        if lower_bound >= _DTW_FLOOR_DISTANCE:
+            distance = lower_bound
+            logger.info("LB_Keogh下限: %s（DTWを省略）", distance)
         else:
-            # 頑張ろう
-            similarity_score = max(20, 25 - (distance - 40000) / 10000)
+            # フレーム間のユークリッド距離行列を一括計算し、帯域付きDTWで距離を計算
+            cost = _frame_distances(user_mfcc_t, reference_mfcc_t)
+            distance = float(_banded_dtw(cost, window)) * step
+            logger.info("DTW距離: %s", distance)
         
-        print(f"スコア: {similarity_score:.2f}")
+        # 距離を類似度スコアに変換（0-100の範囲）
+        similarity_score = _distance_to_score(distance)
+        
+        logger.info("スコア: %.2f", similarity_score)
         
         return float(max(0, min(100, similarity_score)))
     
     def compare_pronunciation(
         self,
-        user_audio_path: str,
+        user_audio_path: Union[str, BinaryIO],
         reference_audio_path: str,
-        user_level: str = "beginner"
+        user_level: str = "beginner",
+        user_audio_key: Optional[str] = None
     ) -> Dict:
         """
         ユーザーの発音と参照音声を比較（DTWベース）
         
         Parameters:
-        - user_audio_path: ユーザー音声のパス
+        - user_audio_path: ユーザー音声のパス、またはメモリ上の音声（BytesIOなど）
         - reference_audio_path: 参照音声のパス
         - user_level: ユーザーのレベル（beginner/intermediate/advanced）
+        - user_audio_key: ユーザー音声のハッシュ（指定すると特徴量をキャッシュする）
         
         Returns:
         - comparison: 比較結果
         """
-        # ユーザー音声を読み込み
-        user_audio, _ = self.load_audio(user_audio_path)
-        user_features = self.extract_features(user_audio)
+        # 参照音声の特徴量取得をバックグラウンドで開始
+        reference_future = _POOL.submit(self.get_reference_features, reference_audio_path)
+        
+        # ユーザー音声を読み込み（同じ録音の特徴量はキャッシュから取得）
+        user_features = self.get_user_features(user_audio_path, user_audio_key)
         
+        # 参照音声の特徴量を取得（キャッシュ済みなら再抽出しない）
+        reference_features = reference_future.result()
+        
+        return self._compare_features(user_features, reference_features, user_level)
+    
+    def compare_pronunciation_levels(
+        self,
+        user_audio_path: Union[str, BinaryIO],
+        reference_audio_path: str,
+        user_levels: List[str],
+        user_audio_key: Optional[str] = None
+    ) -> Dict[str, Dict]:
+        """
+        1つの録音を複数のレベルで評価（読み込みと特徴量抽出は1回だけ行う）
+        
+        Parameters:
+        - user_audio_path: ユーザー音声のパス、またはメモリ上の音声（BytesIOなど）
+        - reference_audio_path: 参照音声のパス
+        - user_levels: 評価するレベルのリスト
+        - user_audio_key: ユーザー音声のハッシュ（指定すると特徴量をキャッシュする）
+        
+        Returns:
+        - comparisons: レベルごとの比較結果
+        """
+        reference_future = _POOL.submit(self.get_reference_features, reference_audio_path)
+        
+        user_features = self.get_user_features(user_audio_path, user_audio_key)
+        
+        reference_features = reference_future.result()
+        
+        return {
+            level: self._compare_features(user_features, reference_features, level)
+            for level in user_levels
+        }
+    
+    def compare_pronunciation_batch(
+        self,
+        user_audio_paths: List[str],
+        reference_audio_path: str,
+        user_level: str = "beginner"
+    ) -> List[Dict]:
+        """
+        複数のユーザー音声を同じ参照音声と比較（レッスンの一括採点用）
+        
+        各音声の読み込み・特徴量抽出・DTWをスレッドプールで並列に実行する
+        
+        Parameters:
+        - user_audio_paths: ユーザー音声のパスのリスト
+        - reference_audio_path: 参照音声のパス
+        - user_level: ユーザーのレベル（beginner/intermediate/advanced）
+        
+        Returns:
+        - comparisons: 入力と同じ順序の比較結果のリスト
+        """
+        # 参照音声の特徴量は先に1回だけ取得（プール内で別タスクを待たないようにする）
+        reference_features = self.get_reference_features(reference_audio_path)
+        
+        def compare_one(user_audio_path: str) -> Dict:
+            user_audio, _ = self.load_audio(user_audio_path)
+            user_features = self.extract_features(user_audio)
+            return self._compare_features(user_features, reference_features, user_level)
+        
+        return list(_POOL.map(compare_one, user_audio_paths))
+    
+    def _compare_features(
+        self,
+        user_features: Dict,
+        reference_features: Dict,
+        user_level: str
+    ) -> Dict:
+        """
+        抽出済みの特徴量から類似度スコアとフィードバックを計算
+        
+        Parameters:
+        - user_features: ユーザー音声の特徴量
+        - reference_features: 参照音声の特徴量
+        - user_level: ユーザーのレベル
+        
+        Returns:
+        - comparison: 比較結果
+        """
         # 無音検出：RMSエネルギーが非常に低い場合は0点
         if user_features['rms_mean'] < 0.001:
-            print(f"無音検出: RMS={user_features['rms_mean']}")
-            # 参照音声も読み込んで特徴量を取得（レスポンス用）
-            reference_audio, _ = self.load_audio(reference_audio_path)
-            reference_features = self.extract_features(reference_audio)
+            logger.info("無音検出: RMS=%s", user_features['rms_mean'])
             
             feedback = self.generate_feedback(
                 0,  # スコア0
@@ -331,41 +1073,37 @@ class AudioProcessor:
                 "level": user_level
             }
         
-        # 参照音声を読み込み
-        reference_audio, _ = self.load_audio(reference_audio_path)
-        reference_features = self.extract_features(reference_audio)
-        
         # DTWで類似度を計算
         dtw_score = self.calculate_dtw_similarity(
             user_features['mfcc'],
             reference_features['mfcc']
         )
         
-        print(f"DTWスコア: {dtw_score:.2f}")
+        logger.info("DTWスコア: %.2f", dtw_score)
         
         # ピッチの差をペナルティとして計算
         pitch_diff = abs(user_features['pitch_mean'] - reference_features['pitch_mean'])
         pitch_diff_percent = (pitch_diff / reference_features['pitch_mean'] * 100) if reference_features['pitch_mean'] > 0 else 0
         pitch_penalty = min(15, pitch_diff_percent / 4)  # 最大15点減点
-        print(f"ピッチ差: {pitch_diff:.2f}Hz ({pitch_diff_percent:.1f}%), ペナルティ: {pitch_penalty:.1f}点")
+        logger.info("ピッチ差: %.2fHz (%.1f%%), ペナルティ: %.1f点", pitch_diff, pitch_diff_percent, pitch_penalty)
         
         # 音量の差をペナルティとして計算
         rms_diff = abs(user_features['rms_mean'] - reference_features['rms_mean'])
         rms_diff_percent = (rms_diff / reference_features['rms_mean'] * 100) if reference_features['rms_mean'] > 0 else 0
         rms_penalty = min(10, rms_diff_percent / 5)  # 最大10点減点
-        print(f"音量差: {rms_diff:.4f} ({rms_diff_percent:.1f}%), ペナルティ: {rms_penalty:.1f}点")
+        logger.info("音量差: %.4f (%.1f%%), ペナルティ: %.1f点", rms_diff, rms_diff_percent, rms_penalty)
         
         # 長さの差をペナルティとして計算
         duration_diff = abs(user_features['duration'] - reference_features['duration'])
         duration_diff_percent = (duration_diff / reference_features['duration'] * 100) if reference_features['duration'] > 0 else 0
         duration_penalty = min(10, duration_diff_percent / 4)  # 最大10点減点
-        print(f"長さ差: {duration_diff:.2f}秒 ({duration_diff_percent:.1f}%), ペナルティ: {duration_penalty:.1f}点")
+        logger.info("長さ差: %.2f秒 (%.1f%%), ペナルティ: %.1f点", duration_diff, duration_diff_percent, duration_penalty)
         
         # 総合スコア = DTWスコア - ペナルティ
         total_penalty = pitch_penalty + rms_penalty + duration_penalty
         similarity_score = max(20, dtw_score - total_penalty)
-        print(f"総合ペナルティ: {total_penalty:.1f}点")
-        print(f"最終スコア: {similarity_score:.2f} (DTW: {dtw_score:.2f} - ペナルティ: {total_penalty:.1f})")
+        logger.info("総合ペナルティ: %.1f点", total_penalty)
+        logger.info("最終スコア: %.2f (DTW: %.2f - ペナルティ: %.1f)", similarity_score, dtw_score, total_penalty)
         
         # レベルに応じたフィードバックを生成
         feedback = self.generate_feedback(
@@ -414,133 +1152,40 @@ class AudioProcessor:
         """
         # 明確な評価基準（全レベル共通）
         # ユーザーが理解しやすいシンプルな基準
-        if similarity_score >= 85:
-            overall_rating = "素晴らしい"
-            overall_message = "✨ 素晴らしい発音です！ネイティブに近い発音ができています。"
-            rating_emoji = "🌟"
-        elif similarity_score >= 70:
-            overall_rating = "良い"
-            overall_message = "👍 良い発音です！この調子で練習を続けましょう。"
-            rating_emoji = "😊"
-        elif similarity_score >= 50:
-            overall_rating = "まあまあ"
-            overall_message = "📝 まあまあの発音です。下記の詳細を参考に改善しましょう。"
-            rating_emoji = "🤔"
-        elif similarity_score >= 30:
-            overall_rating = "要改善"
-            overall_message = "💪 練習が必要です。下記のフィードバックに注意してください。"
-            rating_emoji = "😓"
-        else:
-            overall_rating = "不合格"
-            overall_message = "❌ 発音が大きく異なります。参照音声をよく聞いて、繰り返し練習してください。"
-            rating_emoji = "😢"
+        overall_rating, overall_message, rating_emoji = _OVERALL_RATINGS[
+            bisect_right(_OVERALL_THRESHOLDS, similarity_score)
+        ]
         
         # 詳細なフィードバックを生成
         details = []
         
-        # スコアに応じたフィードバックレベル
+        # 総合スコアが低い場合は、各項目のスコアも厳しく評価（上限を設ける）
         is_very_low_score = similarity_score < 30  # 非常に悪い
         is_low_score = 30 <= similarity_score < 50  # 悪い
-        is_medium_score = 50 <= similarity_score < 70  # 普通
-        
-        # ピッチの比較
-        pitch_diff = abs(user_features['pitch_mean'] - reference_features['pitch_mean'])
-        pitch_diff_percent = (pitch_diff / reference_features['pitch_mean'] * 100) if reference_features['pitch_mean'] > 0 else 0
-        
-        # ピッチスコアを計算（0-100）
-        pitch_score = max(0, min(100, 100 - pitch_diff_percent))
-        
-        # 総合スコアが低い場合は、ピッチスコアも厳しく評価
         if is_very_low_score:
-            pitch_score = min(pitch_score, 29)  # 最大29点
+            score_cap = 29  # 最大29点
         elif is_low_score:
-            pitch_score = min(pitch_score, 49)  # 最大49点
-        
-        # ピッチスコアに基づいてコメントを生成
-        if pitch_score >= 70:
-            pitch_comment = "✅ ピッチが良いです！"
-        elif pitch_score >= 50:
-            if user_features['pitch_mean'] > reference_features['pitch_mean']:
-                pitch_comment = "⚠️ ピッチが少し高めです。もう少し低く話してみましょう。"
-            else:
-                pitch_comment = "⚠️ ピッチが少し低めです。もう少し高く話してみましょう。"
+            score_cap = 49  # 最大49点
         else:
-            if user_features['pitch_mean'] > reference_features['pitch_mean']:
-                pitch_comment = "❌ ピッチが違います。声が高すぎます。参照音声のように低く話してください。"
-            else:
-                pitch_comment = "❌ ピッチが違います。声が低すぎます。参照音声のように高く話してください。"
-        
-        details.append({
-            "aspect": "ピッチ",
-            "comment": pitch_comment,
-            "score": round(pitch_score, 1)
-        })
-        
-        # 音声の長さ（タイミング）の比較
-        duration_diff = abs(user_features['duration'] - reference_features['duration'])
-        duration_diff_percent = (duration_diff / reference_features['duration'] * 100) if reference_features['duration'] > 0 else 0
-        
-        # タイミングスコアを計算（0-100）
-        timing_score = max(0, min(100, 100 - duration_diff_percent))
-        
-        # 総合スコアが低い場合は、タイミングスコアも厳しく評価
-        if is_very_low_score:
-            timing_score = min(timing_score, 29)  # 最大29点
-        elif is_low_score:
-            timing_score = min(timing_score, 49)  # 最大49点
-        
-        # タイミングスコアに基づいてコメントを生成
-        if timing_score >= 70:
-            timing_comment = "✅ タイミングが素晴らしいです！"
-        elif timing_score >= 50:
-            if user_features['duration'] > reference_features['duration']:
-                timing_comment = "⚠️ 少しゆっくり話しています。ネイティブのペースに合わせてみましょう。"
-            else:
-                timing_comment = "⚠️ 少し早口です。もう少しゆっくり話してみましょう。"
-        else:
-            if user_features['duration'] > reference_features['duration']:
-                timing_comment = "❌ タイミングが違います。かなりゆっくり話しています。参照音声のペースに合わせてください。"
-            else:
-                timing_comment = "❌ タイミングが違います。かなり早口です。参照音声のようにゆっくり話してください。"
-        
-        details.append({
-            "aspect": "タイミング",
-            "comment": timing_comment,
-            "score": round(timing_score, 1)
-        })
-        
-        # エネルギー（音量）の比較
-        rms_diff = abs(user_features['rms_mean'] - reference_features['rms_mean'])
-        rms_diff_percent = (rms_diff / reference_features['rms_mean'] * 100) if reference_features['rms_mean'] > 0 else 0
+            score_cap = 100
         
-        # 音量スコアを計算（0-100）
-        volume_score = max(0, min(100, 100 - rms_diff_percent))
-        
-        # 総合スコアが低い場合は、音量スコアも厳しく評価
-        if is_very_low_score:
-            volume_score = min(volume_score, 29)  # 最大29点
-        elif is_low_score:
-            volume_score = min(volume_score, 49)  # 最大49点
-        
-        # 音量スコアに基づいてコメントを生成
-        if volume_score >= 70:
-            volume_comment = "✅ 音量が良いです！"
-        elif volume_score >= 50:
-            if user_features['rms_mean'] > reference_features['rms_mean']:
-                volume_comment = "⚠️ もう少し小さな声で話してみましょう。"
-            else:
-                volume_comment = "⚠️ もう少し大きな声ではっきりと話してみましょう。"
-        else:
-            if user_features['rms_mean'] > reference_features['rms_mean']:
-                volume_comment = "❌ 音量が違います。声が大きすぎます。参照音声のように小さな声で話してください。"
-            else:
-                volume_comment = "❌ 音量が違います。声が小さすぎます。参照音声のようにはっきりと話してください。"
-        
-        details.append({
-            "aspect": "音量",
-            "comment": volume_comment,
-            "score": round(volume_score, 1)
-        })
+        # ピッチ・タイミング・音量を同じ手順で評価
+        for aspect, key, comments in _FEEDBACK_ASPECTS:
+            user_value = user_features[key]
+            reference_value = reference_features[key]
+            
+            # 参照音声との差（%）から項目スコアを計算（0-100）
+            diff_percent = (abs(user_value - reference_value) / reference_value * 100) if reference_value > 0 else 0
+            aspect_score = min(max(0, min(100, 100 - diff_percent)), score_cap)
+            
+            # 項目スコアと、参照より高い/長い/大きいかでコメントを選ぶ
+            comment = comments[bisect_right(_ASPECT_THRESHOLDS, aspect_score)][user_value > reference_value]
+            
+            details.append({
+                "aspect": aspect,
+                "comment": comment,
+                "score": round(aspect_score, 1)
+            })
         
         # スコアが非常に低い場合は、全体的な改善点を追加
         if is_very_low_score:
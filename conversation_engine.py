@@ -2,12 +2,31 @@
 AI会話エンジン - Gemini APIを使用したビサヤ語会話システム
 """
 
-import google.generativeai as genai
+import asyncio
+import hashlib
 import os
-from typing import Dict, List, Optional
+import re
+import uuid
+from collections import deque
+from itertools import islice
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from datetime import datetime
 import json
 
+# プロンプト作成用に保持する会話履歴の最大件数（フィードバック用の全履歴は別に保持する）
+MAX_HISTORY_MESSAGES = 32
+
+# プロンプトに含める直近の会話履歴の件数
+PROMPT_HISTORY_MESSAGES = 5
+
+# 括弧（全角・半角）で囲まれた日本語訳
+_TRANSLATION_PATTERN = re.compile(r'[（(].*?[）)]')
+
+# AI応答の解析用：「訳：」の行の区切り（全角・半角のコロン）、発音のヒントの行
+_LABEL_SEPARATOR_PATTERN = re.compile(r'[：:]')
+_TIP_PATTERN = re.compile(r'発音|ヒント|コツ')
+
+
 class ConversationEngine:
     """AI会話エンジン - ビサヤ語学習用の対話システム"""
     
@@ -22,6 +41,9 @@ class ConversationEngine:
         if not self.api_key:
             raise ValueError("Gemini API key is required. Set GEMINI_API_KEY environment variable.")
         
+        # Gemini SDK（gRPC/protobufを含み重い）は会話エンジンを使うときに初めて読み込む
+        import google.generativeai as genai
+        
         genai.configure(api_key=self.api_key)
         self.model = genai.GenerativeModel('gemini-2.0-flash')
         
@@ -46,7 +68,11 @@ class ConversationEngine:
             "mode": mode,
             "level": level,
             "system_prompt": system_prompt,
-            "history": [],
+            "history": deque(maxlen=MAX_HISTORY_MESSAGES),
+            # セッション終了時のフィードバック用に、全メッセージを追記のみで保持
+            "full_log": [],
+            "user_turns": 0,
+            "ai_turns": 0,
             "created_at": datetime.now().isoformat()
         }
         
@@ -163,19 +189,10 @@ class ConversationEngine:
         session = self.sessions[session_id]
         
         # ユーザーメッセージを履歴に追加
-        session["history"].append({
-            "role": "user",
-            "content": user_message,
-            "timestamp": datetime.now().isoformat()
-        })
+        self._append_history(session, "user", user_message)
         
         # プロンプトを構築
-        full_prompt = session["system_prompt"] + "\n\n会話履歴:\n"
-        for msg in session["history"][-5:]:  # 直近5件のみ使用
-            role = "ユーザー" if msg["role"] == "user" else "AI"
-            full_prompt += f"{role}: {msg['content']}\n"
-        
-        full_prompt += "\nAI: "
+        full_prompt = self._build_prompt(session)
         
         try:
             # Gemini APIで応答を生成
@@ -183,33 +200,22 @@ class ConversationEngine:
             ai_message = response.text
             
             # AI応答を履歴に追加
-            session["history"].append({
-                "role": "assistant",
-                "content": ai_message,
-                "timestamp": datetime.now().isoformat()
-            })
+            self._append_history(session, "assistant", ai_message)
             
             # 応答を解析（ビサヤ語と日本語訳を分離）
             parsed_response = self._parse_response(ai_message)
             
-            # 音声ファイルを生成
+            # 音声ファイルはバックグラウンドで生成し、URL（テキストのハッシュで決まる）だけ先に返す
             audio_url = None
             if parsed_response["bisaya"]:
-                try:
-                    audio_url = self._generate_audio(parsed_response["bisaya"], session_id)
-                    print(f"✓ Audio generated: {audio_url}")
-                except Exception as audio_error:
-                    print(f"⚠ Audio generation failed: {audio_error}")
+                _, filename = self._audio_filename(parsed_response["bisaya"])
+                audio_url = f"/audio/{filename}"
+                audio_future = asyncio.get_running_loop().run_in_executor(
+                    None, self._generate_audio, parsed_response["bisaya"], session_id
+                )
+                audio_future.add_done_callback(self._log_audio_result)
             
-            return {
-                "status": "success",
-                "ai_message": ai_message,
-                "bisaya_text": parsed_response["bisaya"],
-                "japanese_translation": parsed_response["japanese"],
-                "pronunciation_tips": parsed_response["tips"],
-                "audio_url": audio_url,
-                "session_id": session_id
-            }
+            return self._build_result(session_id, ai_message, parsed_response, audio_url)
             
         except Exception as e:
             return {
@@ -218,42 +224,146 @@ class ConversationEngine:
                 "session_id": session_id
             }
     
+    async def stream_message(self, session_id: str, user_message: str) -> AsyncIterator[Dict]:
+        """
+        ユーザーメッセージを送信し、AIの応答をストリーミングで受け取る
+        
+        応答の断片が届くたびに{"type": "chunk"}を返し、最後にsend_messageと同じ内容を
+        {"type": "done"}として返す。日本語訳の括弧が閉じた時点でビサヤ語の文は確定するので、
+        応答の残りを待たずに音声生成を始める
+        
+        Parameters:
+        - session_id: セッションID
+        - user_message: ユーザーのメッセージ（テキスト）
+        
+        Yields:
+        - 応答の断片、または最終結果
+        """
+        if session_id not in self.sessions:
+            raise ValueError(f"Session {session_id} not found")
+        
+        session = self.sessions[session_id]
+        self._append_history(session, "user", user_message)
+        full_prompt = self._build_prompt(session)
+        
+        loop = asyncio.get_running_loop()
+        ai_message = ""
+        early_bisaya = None
+        early_audio = None
+        
+        try:
+            # Gemini APIで応答をストリーミング生成
+            response = await self.model.generate_content_async(full_prompt, stream=True)
+            async for chunk in response:
+                ai_message += chunk.text
+                yield {"type": "chunk", "text": chunk.text, "session_id": session_id}
+                
+                if early_audio is None and '）' in ai_message:
+                    early_bisaya = self._parse_response(ai_message)["bisaya"]
+                    early_audio = loop.run_in_executor(None, self._generate_audio, early_bisaya, session_id)
+        except Exception as e:
+            # 先に始めた音声生成は待たないので、結果（例外を含む）はコールバックでログに出す
+            if early_audio is not None:
+                early_audio.add_done_callback(self._log_audio_result)
+            yield {"type": "error", "status": "error", "error": str(e), "session_id": session_id}
+            return
+        
+        # AI応答を履歴に追加
+        self._append_history(session, "assistant", ai_message)
+        
+        # 応答を解析（ビサヤ語と日本語訳を分離）
+        parsed_response = self._parse_response(ai_message)
+        
+        # 音声ファイルを生成（先に始めた生成と文が同じならその結果を使う）
+        audio_url = None
+        if early_audio is not None and early_bisaya != parsed_response["bisaya"]:
+            # 文が変わって使わなくなった音声生成も、結果（例外を含む）はコールバックでログに出す
+            early_audio.add_done_callback(self._log_audio_result)
+        if parsed_response["bisaya"]:
+            try:
+                if early_audio is not None and early_bisaya == parsed_response["bisaya"]:
+                    audio_url = await early_audio
+                else:
+                    audio_url = await loop.run_in_executor(None, self._generate_audio, parsed_response["bisaya"], session_id)
+                print(f"✓ Audio generated: {audio_url}")
+            except Exception as audio_error:
+                print(f"⚠ Audio generation failed: {audio_error}")
+        
+        yield {"type": "done", **self._build_result(session_id, ai_message, parsed_response, audio_url)}
+    
+    def _append_history(self, session: Dict, role: str, content: str) -> None:
+        """会話履歴にメッセージを追加（プロンプト用の履歴は上限を超えると古いものを捨てる）"""
+        session["user_turns" if role == "user" else "ai_turns"] += 1
+        message = {
+            "role": role,
+            "content": content,
+            "timestamp": datetime.now().isoformat()
+        }
+        session["history"].append(message)
+        session["full_log"].append(message)
+    
+    def _build_prompt(self, session: Dict) -> str:
+        """システムプロンプトと直近の会話履歴からプロンプトを構築"""
+        full_prompt = session["system_prompt"] + "\n\n会話履歴:\n"
+        history = session["history"]
+        for msg in islice(history, max(0, len(history) - PROMPT_HISTORY_MESSAGES), None):  # 直近5件のみ使用
+            role = "ユーザー" if msg["role"] == "user" else "AI"
+            full_prompt += f"{role}: {msg['content']}\n"
+        
+        full_prompt += "\nAI: "
+        return full_prompt
+    
+    def _build_result(self, session_id: str, ai_message: str, parsed_response: Dict, audio_url: Optional[str]) -> Dict:
+        """AI応答の解析結果からレスポンスを作成"""
+        return {
+            "status": "success",
+            "ai_message": ai_message,
+            "bisaya_text": parsed_response["bisaya"],
+            "japanese_translation": parsed_response["japanese"],
+            "pronunciation_tips": parsed_response["tips"],
+            "audio_url": audio_url,
+            "session_id": session_id
+        }
+    
     def _parse_response(self, response: str) -> Dict:
         """
         AI応答を解析してビサヤ語、日本語訳、発音のヒントを抽出
         """
-        lines = response.split('\n')
         bisaya = ""
         japanese = ""
-        tips = ""
+        tips = []
         
-        for line in lines:
+        # 1行ずつ1回だけ走査する（訳が複数ある場合は後の行で上書きする）
+        for line in response.split('\n'):
             line = line.strip()
             if not line:
                 continue
             
             # 日本語訳を検出（括弧内または「訳：」の後）
             if '（' in line and '）' in line:
-                parts = line.split('（')
-                bisaya = parts[0].strip()
-                japanese = parts[1].replace('）', '').strip()
+                before, _, after = line.partition('（')
+                bisaya = before.strip()
+                japanese = after.split('（', 1)[0].replace('）', '').strip()
             elif '訳：' in line or '訳:' in line:
-                japanese = line.split('：')[-1].split(':')[-1].strip()
-            elif '発音' in line or 'ヒント' in line or 'コツ' in line:
-                tips += line + " "
+                japanese = _LABEL_SEPARATOR_PATTERN.split(line)[-1].strip()
+            elif _TIP_PATTERN.search(line):
+                tips.append(line)
             elif not japanese and not bisaya:
                 bisaya = line
         
         return {
             "bisaya": bisaya or response,
             "japanese": japanese,
-            "tips": tips.strip()
+            "tips": " ".join(tips)
         }
     
     def _generate_audio(self, text: str, session_id: str) -> str:
         """
         テキストから音声ファイルを生成
         
+        同じテキストの音声は使い回す（ファイル名をテキストのハッシュにして、
+        既に生成済みならgTTSを呼ばない）
+        
         Parameters:
         - text: ビサヤ語テキスト
         - session_id: セッションID
@@ -262,31 +372,55 @@ class ConversationEngine:
         - 音声ファイルのURL
         """
         from gtts import gTTS
-        import os
-        import re
         
-        # 括弧内の日本語訳を削除（ビサヤ語のみを抽出）
-        # 例: "Maayong buntag! （おはよう）" → "Maayong buntag!"
-        clean_text = re.sub(r'[（(].*?[）)]', '', text).strip()
+        clean_text, filename = self._audio_filename(text)
         
         # 音声ファイルの保存先
         audio_dir = "audio_files"
         os.makedirs(audio_dir, exist_ok=True)
-        
-        # ファイル名を生成
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-        filename = f"tts_{session_id}_{timestamp}.mp3"
         filepath = os.path.join(audio_dir, filename)
         
-        # Google TTSで音声生成
-        # ビサヤ語は直接サポートされていないため、タガログ語(tl)を使用
-        # slow=Trueで少しゆっくり話すことで聞き取りやすくする
-        tts = gTTS(text=clean_text, lang='tl', slow=True)
-        tts.save(filepath)
+        if not os.path.exists(filepath):
+            # Google TTSで音声生成
+            # ビサヤ語は直接サポートされていないため、タガログ語(tl)を使用
+            # slow=Trueで少しゆっくり話すことで聞き取りやすくする
+            tts = gTTS(text=clean_text, lang='tl', slow=True)
+            # 書き込み途中のファイルを返さないよう、一時ファイルに保存してから置き換える
+            temp_path = f"{filepath}.{uuid.uuid4().hex}.tmp"
+            tts.save(temp_path)
+            os.replace(temp_path, filepath)
         
         # URLを返す
         return f"/audio/{filename}"
     
+    def _audio_filename(self, text: str) -> Tuple[str, str]:
+        """
+        音声にするテキストと、その音声のファイル名を求める
+        
+        Parameters:
+        - text: ビサヤ語テキスト
+        
+        Returns:
+        - clean_text: 括弧内の日本語訳を除いたテキスト
+        - filename: テキストと音声設定のハッシュから決まるファイル名
+        """
+        # 括弧内の日本語訳を削除（ビサヤ語のみを抽出）
+        # 例: "Maayong buntag! （おはよう）" → "Maayong buntag!"
+        clean_text = _TRANSLATION_PATTERN.sub('', text).strip()
+        
+        text_hash = hashlib.sha1(f"{clean_text}|tl|slow".encode("utf-8")).hexdigest()[:16]
+        return clean_text, f"tts_{text_hash}.mp3"
+    
+    def _log_audio_result(self, future: asyncio.Future) -> None:
+        """バックグラウンドでの音声生成の結果をログに出力"""
+        if future.cancelled():
+            return
+        audio_error = future.exception()
+        if audio_error is not None:
+            print(f"⚠ Audio generation failed: {audio_error}")
+        else:
+            print(f"✓ Audio generated: {future.result()}")
+    
     def get_session_summary(self, session_id: str) -> Dict:
         """
         会話セッションのサマリーを生成
@@ -301,21 +435,20 @@ class ConversationEngine:
             raise ValueError(f"Session {session_id} not found")
         
         session = self.sessions[session_id]
-        history = session["history"]
         
-        # 統計情報を計算
-        user_messages = [msg for msg in history if msg["role"] == "user"]
-        ai_messages = [msg for msg in history if msg["role"] == "assistant"]
+        # 統計情報（履歴は上限で切り捨てられるため、件数はカウンタから取る）
+        user_turns = session["user_turns"]
+        ai_turns = session["ai_turns"]
         
         return {
             "session_id": session_id,
             "mode": session["mode"],
             "level": session["level"],
             "created_at": session["created_at"],
-            "total_turns": len(user_messages),
-            "duration_estimate": len(history) * 30,  # 1ターン30秒と仮定
-            "user_messages_count": len(user_messages),
-            "ai_messages_count": len(ai_messages)
+            "total_turns": user_turns,
+            "duration_estimate": (user_turns + ai_turns) * 30,  # 1ターン30秒と仮定
+            "user_messages_count": user_turns,
+            "ai_messages_count": ai_turns
         }
     
     def generate_feedback(self, session_id: str) -> Dict:
@@ -342,7 +475,7 @@ class ConversationEngine:
 
 会話履歴:
 """
-        for msg in session["history"]:
+        for msg in session["full_log"]:
             role = "学習者" if msg["role"] == "user" else "講師"
             feedback_prompt += f"{role}: {msg['content']}\n"
         
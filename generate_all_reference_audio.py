@@ -3,9 +3,19 @@
 Google Text-to-Speech (gTTS) を使用してビサヤ語の音声を生成
 """
 
-from gtts import gTTS
+from gtts import gTTS, gTTSError
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from typing import Dict
+import argparse
+import hashlib
+import io
+import json
+import os
+import random
 import re
+import time
+import uuid
 
 # 全70個のフレーズリスト
 PHRASES = {
@@ -117,22 +127,113 @@ PHRASES = {
 }
 
 
+# ファイル名に使えない文字
+_UNSAFE_FILENAME_CHARS = re.compile(r'[^\w\-]')
+
+
 def sanitize_filename(text: str) -> str:
     """
     ファイル名として使用できる文字列に変換
     """
-    # スペースをアンダースコアに
-    text = text.replace(" ", "_")
-    # 特殊文字を削除
-    text = re.sub(r'[^\w\-]', '', text)
-    # 小文字に
-    text = text.lower()
-    return text
+    # スペースをアンダースコアにして特殊文字を削除し、小文字に
+    return _UNSAFE_FILENAME_CHARS.sub('', text.replace(" ", "_")).lower()
+
+
+# 生成済み音声のテキストのハッシュを記録するファイル（テキストが変わったものだけ作り直す）
+MANIFEST_FILENAME = ".manifest.json"
+
+# gTTSを並行して呼び出すスレッド数
+MAX_WORKERS = 8
+
+# gTTSの呼び出しが一時的に失敗した場合の最大試行回数
+MAX_ATTEMPTS = 5
+
+
+# オフライン生成（ダミー音声）のサンプリングレート
+OFFLINE_SAMPLE_RATE = 22050
+
+
+def text_hash(text: str, offline: bool = False) -> str:
+    """
+    フレーズのテキストと音声設定からハッシュを計算
+    （オフライン生成したダミー音声は別のハッシュにし、次回のgTTS実行で作り直されるようにする）
+    """
+    engine = "offline" if offline else "tl"
+    return hashlib.sha1(f"{text}|{engine}".encode("utf-8")).hexdigest()
+
+
+def load_manifest(reference_dir: Path) -> Dict[str, str]:
+    """
+    生成済み音声のマニフェスト（キー → テキストのハッシュ）を読み込む
+    """
+    try:
+        return json.loads((reference_dir / MANIFEST_FILENAME).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(reference_dir: Path, manifest: Dict[str, str]):
+    """
+    生成済み音声のマニフェストを保存
+    """
+    (reference_dir / MANIFEST_FILENAME).write_text(
+        json.dumps(manifest, indent=2, sort_keys=True), encoding="utf-8"
+    )
+
+
+def generate_phrase_audio(text: str, filepath: Path):
+    """
+    1つのフレーズの参照音声を生成して保存
+    """
+    # gTTSでフィリピン語（タガログ語）の音声を生成
+    # ビサヤ語は直接サポートされていないが、フィリピン語で近い発音が得られる
+    tts = gTTS(text=text, lang='tl', slow=False)  # 'tl' = Tagalog/Filipino
+    
+    # 一時的なエラーは指数バックオフ（ランダムな揺らぎ付き）で再試行
+    # 途中で失敗しても壊れたファイルが残らないよう、一時ファイルに保存してから置き換える
+    temp_path = filepath.with_name(f"{filepath.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                tts.save(str(temp_path))
+                os.replace(temp_path, filepath)
+                return
+            except gTTSError as e:
+                if attempt == MAX_ATTEMPTS - 1:
+                    raise
+                # レート制限（429）の場合は長めに待つ
+                if "429" in str(e):
+                    delay = min(60, 2 ** attempt * 2)
+                else:
+                    delay = 2 ** attempt * 0.5
+                time.sleep(delay + random.random() * 0.3)
+    finally:
+        # 置き換え済みなら何もしない（失敗時の書きかけだけを消す）
+        temp_path.unlink(missing_ok=True)
 
 
-def generate_reference_audio():
+def encode_offline_audio() -> bytes:
+    """
+    ネットワークを使わずにダミー音声を合成し、MP3のバイト列にエンコード（開発・CI用）
+    
+    全フレーズで同じ波形になるので、合成とエンコードは1回だけ行う
+    """
+    # オフライン生成でしか使わないので、ここで初めて読み込む
+    import soundfile as sf
+    from generate_reference_audio import generate_dummy_audio
+    
+    audio = generate_dummy_audio(duration=1.5, sample_rate=OFFLINE_SAMPLE_RATE)
+    buffer = io.BytesIO()
+    sf.write(buffer, audio, OFFLINE_SAMPLE_RATE, format='MP3')
+    return buffer.getvalue()
+
+
+def generate_reference_audio(offline: bool = False):
     """
     全フレーズの参照音声を生成
+    
+    Parameters:
+    - offline: Trueの場合はgTTSを使わず、ダミー音声をローカルで生成（既存のファイルは上書きしない）
     """
     reference_dir = Path("reference_audio")
     reference_dir.mkdir(exist_ok=True)
@@ -142,31 +243,70 @@ def generate_reference_audio():
     print("=" * 70)
     print(f"\n📁 Output directory: {reference_dir.absolute()}")
     print(f"🎯 Total phrases: {len(PHRASES)}")
-    print("\n⚠️  Note: Using Google TTS with Filipino language")
-    print("   For best results, consider using native Bisaya recordings.\n")
+    if offline:
+        print("\n⚠️  Note: Offline mode - writing dummy audio for missing phrases only")
+        print("   Run without --offline to generate real audio with Google TTS.\n")
+    else:
+        print("\n⚠️  Note: Using Google TTS with Filipino language")
+        print("   For best results, consider using native Bisaya recordings.\n")
     
     success_count = 0
+    skipped_count = 0
     error_count = 0
+    manifest = load_manifest(reference_dir)
     
+    # 生成が必要なフレーズを選ぶ
+    pending = {}
     for key, text in PHRASES.items():
-        try:
-            filename = f"{key}_ref.mp3"
-            filepath = reference_dir / filename
-            
-            # gTTSでフィリピン語（タガログ語）の音声を生成
-            # ビサヤ語は直接サポートされていないが、フィリピン語で近い発音が得られる
-            tts = gTTS(text=text, lang='tl', slow=False)  # 'tl' = Tagalog/Filipino
-            tts.save(str(filepath))
-            
-            print(f"✓ Created: {filename} - '{text}'")
+        filename = f"{key}_ref.mp3"
+        filepath = reference_dir / filename
+        digest = text_hash(text, offline)
+        
+        # 生成済みでテキストが変わっていなければスキップ
+        # （マニフェストにないファイルは手動で置いた録音とみなして上書きしない。
+        #   書き込みは一時ファイルからの置き換えなので、書きかけのファイルは残らない）
+        # オフライン生成はダミー音声なので、既存のファイルは一切上書きしない
+        if filepath.exists() and filepath.stat().st_size > 0 and (offline or manifest.get(key, digest) == digest):
+            print(f"- Skipped: {filename} (already exists)")
+            skipped_count += 1
+            continue
+        
+        pending[key] = text
+    
+    if offline and pending:
+        # ダミー音声は全フレーズ共通なので、同じバイト列を書き込むだけ
+        mp3_bytes = encode_offline_audio()
+        for key, text in pending.items():
+            (reference_dir / f"{key}_ref.mp3").write_bytes(mp3_bytes)
+            manifest[key] = text_hash(text, offline=True)
+            print(f"✓ Created (offline dummy): {key}_ref.mp3 - '{text}'")
             success_count += 1
-            
-        except Exception as e:
-            print(f"✗ Error creating {key}: {e}")
-            error_count += 1
+        pending = {}
+    
+    # gTTSの呼び出しは通信待ちがほとんどなので、スレッドで並行して生成する
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {
+            executor.submit(generate_phrase_audio, text, reference_dir / f"{key}_ref.mp3"): key
+            for key, text in pending.items()
+        }
+        for future in as_completed(futures):
+            key = futures[future]
+            text = pending[key]
+            try:
+                future.result()
+                manifest[key] = text_hash(text)
+                print(f"✓ Created: {key}_ref.mp3 - '{text}'")
+                success_count += 1
+            except Exception as e:
+                print(f"✗ Error creating {key}: {e}")
+                error_count += 1
+    
+    save_manifest(reference_dir, manifest)
     
     print("\n" + "=" * 70)
     print(f"✓ Successfully generated: {success_count} files")
+    if skipped_count > 0:
+        print(f"- Skipped (already exists): {skipped_count} files")
     if error_count > 0:
         print(f"✗ Errors: {error_count} files")
     print("=" * 70)
@@ -182,8 +322,16 @@ def generate_reference_audio():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate reference audio for all phrases")
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="write local dummy audio for missing phrases instead of calling Google TTS (for dev/CI)"
+    )
+    args = parser.parse_args()
+    
     try:
-        generate_reference_audio()
+        generate_reference_audio(offline=args.offline)
     except KeyboardInterrupt:
         print("\n\n⚠️  Generation cancelled by user")
     except Exception as e:
@@ -8,6 +8,7 @@ reference_audio/ ディレクトリに配置してください。
 本番環境では実際のネイティブ音声に置き換えてください。
 """
 
+import io
 import numpy as np
 import soundfile as sf
 from pathlib import Path
@@ -26,24 +27,23 @@ def generate_dummy_audio(duration: float = 2.0, sample_rate: int = 22050) -> np.
     - audio: 音声データ
     """
     # 複数の周波数を持つ正弦波を生成（音声らしく）
-    t = np.linspace(0, duration, int(sample_rate * duration))
+    # 書き出しはfloat32なので、計算も最初からfloat32で行う
+    t = np.linspace(0, duration, int(sample_rate * duration), dtype=np.float32)
     
     # 基本周波数とハーモニクス
-    frequencies = [200, 400, 600, 800]  # Hz
-    audio = np.zeros_like(t)
+    frequencies = np.array([200, 400, 600, 800], dtype=np.float32)  # Hz
+    amplitudes = np.float32(0.3) / np.arange(1, len(frequencies) + 1, dtype=np.float32)  # 高次ハーモニクスは小さく
     
-    for i, freq in enumerate(frequencies):
-        amplitude = 0.3 / (i + 1)  # 高次ハーモニクスは小さく
-        audio += amplitude * np.sin(2 * np.pi * freq * t)
+    # 全ハーモニクスの正弦波を(周波数 × サンプル)の行列で一度に計算し、振幅で重み付けして合成
+    audio = amplitudes @ np.sin(np.float32(2 * np.pi) * frequencies[:, None] * t)
     
     # エンベロープを適用（自然な音声のように）
-    envelope = np.exp(-t * 0.5)  # 減衰
-    audio = audio * envelope
+    audio *= np.exp(t * np.float32(-0.5))  # 減衰
     
     # ノーマライズ
-    audio = audio / np.max(np.abs(audio)) * 0.8
+    audio *= np.float32(0.8) / np.max(np.abs(audio))
     
-    return audio.astype(np.float32)
+    return audio
 
 
 def create_reference_audio_files():
@@ -69,15 +69,21 @@ def create_reference_audio_files():
     
     sample_rate = 22050
     
+    # ダミー音声を生成（実際にはネイティブ音声を録音して使用）
+    # 引数が同じなので全フレーズで同じ波形になる。1回だけ生成して使い回す
+    audio = generate_dummy_audio(duration=1.5, sample_rate=sample_rate)
+    
+    # WAVへのエンコードも1回だけ行い、同じバイト列を各ファイルにまとめて書き込む
+    buffer = io.BytesIO()
+    sf.write(buffer, audio, sample_rate, format='WAV')
+    wav_bytes = buffer.getvalue()
+    
     for phrase in phrases:
         filename = f"{phrase}_ref.wav"
         filepath = reference_dir / filename
         
-        # ダミー音声を生成（実際にはネイティブ音声を録音して使用）
-        audio = generate_dummy_audio(duration=1.5, sample_rate=sample_rate)
-        
         # WAVファイルとして保存
-        sf.write(filepath, audio, sample_rate)
+        filepath.write_bytes(wav_bytes)
         print(f"Created: {filepath}")
     
     print(f"\n✓ Generated {len(phrases)} reference audio files")
@@ -1,18 +1,33 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Header
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Header, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, ORJSONResponse, Response
 import uvicorn
 import os
+import asyncio
+import hashlib
+import io
+import logging
+import random
+import traceback
+import uuid
+from collections import OrderedDict
 from datetime import datetime
 from pathlib import Path
-import shutil
+import aiofiles
 from audio_processor import AudioProcessor
-from typing import Optional
+from typing import Dict, List, Optional, Tuple, Union
+
+# audio_processorなどのモジュールのログをサーバーログに出力
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title="Bisaya Speak AI API",
     description="AI-powered pronunciation diagnosis for Bisaya language learning",
-    version="1.0.9"
+    version="1.0.9",
+    # orjsonでJSONを高速にシリアライズ（numpyの数値もそのまま扱える）
+    default_response_class=ORJSONResponse
 )
 
 # CORS設定（Kotlinアプリからのアクセスを許可）
@@ -24,6 +39,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def limit_request_size(request: Request, call_next):
+    """
+    Content-Lengthが上限を超えるリクエストは、本文を受け取る前に413で拒否する
+    （チャンク転送などContent-Lengthがない場合はreceive_uploadで1件ごとに上限を確認する）
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_REQUEST_BYTES:
+        return ORJSONResponse(
+            status_code=413,
+            content={"detail": f"Request body too large. Maximum size: {MAX_REQUEST_BYTES // (1024 * 1024)} MB"}
+        )
+    return await call_next(request)
+
 # 音声ファイル保存用ディレクトリ
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
@@ -38,6 +67,194 @@ audio_processor = AudioProcessor()
 # 最小必要バージョン
 MINIMUM_APP_VERSION = "1.0.9"
 
+# 参照音声の拡張子ごとのMIMEタイプ
+REFERENCE_MEDIA_TYPES = {
+    ".mp3": "audio/mpeg",
+    ".wav": "audio/wav",
+    ".m4a": "audio/mp4",
+    ".ogg": "audio/ogg",
+}
+
+# 参照音声はほとんど変わらないので、クライアントやCDNに1日キャッシュさせる
+# （差し替えられた場合はETagで再検証される）
+REFERENCE_CACHE_CONTROL = "public, max-age=86400"
+
+# 単語をファイル名に変換する変換表（スペースとハイフンをアンダースコアに、記号を削除）
+SAFE_WORD_TABLE = str.maketrans(" -", "__", "',?!.")
+
+# アップロードを受け付ける音声の拡張子
+ALLOWED_EXTENSIONS = frozenset({".wav", ".mp3", ".m4a", ".ogg", ".flac", ".3gp", ".amr"})
+ALLOWED_EXTENSIONS_TEXT = ".wav, .mp3, .m4a, .ogg, .flac, .3gp, .amr"
+
+# ユーザーのレベル
+VALID_LEVELS = frozenset({"beginner", "intermediate", "advanced"})
+
+# 参照音声として扱う拡張子（優先順）
+REFERENCE_EXTENSIONS = [".mp3", ".wav", ".m4a", ".ogg"]
+
+
+def build_reference_index() -> Dict[str, Path]:
+    """
+    参照音声ディレクトリを1回だけ走査し、単語ごとの参照音声ファイルの索引を作成
+    
+    Returns:
+    - index: ファイル名用に変換した単語 → 参照音声ファイルのパス
+      （同じ単語に複数の形式がある場合はREFERENCE_EXTENSIONSで先の拡張子を優先）
+    """
+    priority = {ext: i for i, ext in enumerate(REFERENCE_EXTENSIONS)}
+    index: Dict[str, Path] = {}
+    # scandirはディレクトリ読み込み時に種別も取得するので、ファイルごとのstatが不要
+    with os.scandir(REFERENCE_DIR) as entries:
+        for entry in entries:
+            path = Path(entry.path)
+            if path.suffix not in priority or not path.stem.endswith("_ref") or not entry.is_file():
+                continue
+            word = path.stem[:-len("_ref")]
+            current = index.get(word)
+            if current is None or priority[path.suffix] < priority[current.suffix]:
+                index[word] = path
+    return index
+
+
+def refresh_reference_index() -> bool:
+    """
+    参照音声ディレクトリが変更されていれば索引を作り直す
+    
+    ファイルの追加・削除でディレクトリの更新時刻が変わるので、
+    ディレクトリのstat 1回だけで索引が最新か判定できる
+    
+    Returns:
+    - rebuilt: 作り直した場合True
+    """
+    global REFERENCE_INDEX, REFERENCE_INDEX_MTIME
+    mtime = REFERENCE_DIR.stat().st_mtime_ns
+    if mtime == REFERENCE_INDEX_MTIME:
+        return False
+    REFERENCE_INDEX = build_reference_index()
+    REFERENCE_INDEX_MTIME = mtime
+    return True
+
+
+# 参照音声の索引（リクエストごとにファイルシステムを調べない）
+REFERENCE_INDEX_MTIME = REFERENCE_DIR.stat().st_mtime_ns
+REFERENCE_INDEX = build_reference_index()
+
+# アップロードされた音声をディスクに書き込む単位（バイト）
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# この大きさ以下の録音はディスクに書かずメモリ上で処理する（スマホの録音は通常1MB未満）
+UPLOAD_MEMORY_LIMIT = 4 * 1024 * 1024
+
+# アップロードできる音声1件の最大サイズ（10秒程度の録音には十分な大きさ）
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+
+# 1リクエストの本文の最大サイズ（一括診断で複数の音声を送る場合を含む）
+MAX_REQUEST_BYTES = 50 * 1024 * 1024
+
+# デバッグ用：1にするとアップロードされた録音を常にuploads/に保存する
+RETAIN_UPLOADS = os.getenv("DEBUG_RETAIN_UPLOADS") == "1"
+
+# 診断結果のキャッシュ（同じ録音を繰り返し送信した場合に解析を省略する）
+# キー: (音声のハッシュ, 参照音声のパス, 参照音声の更新時刻, レベル)
+RESPONSE_CACHE_SIZE = 2048
+RESPONSE_CACHE: "OrderedDict[Tuple[str, str, float, str], Dict]" = OrderedDict()
+
+
+def log_background_failure(name: str):
+    """
+    バックグラウンドで実行した起動時処理の例外をログに出すコールバックを作成
+    （結果を待たないため、コールバックがないと例外が握りつぶされる）
+    """
+    def callback(future: asyncio.Future):
+        if future.cancelled():
+            return
+        exc = future.exception()
+        if exc is not None:
+            logger.error("%sに失敗しました: %s", name, exc, exc_info=exc)
+    return callback
+
+
+@app.on_event("startup")
+async def preload_reference_features():
+    """起動時に参照音声の特徴量を事前計算（リクエスト受付はブロックしない）"""
+    paths = [str(path) for path in sorted(REFERENCE_INDEX.values())]
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(None, audio_processor.preload_references, paths)
+    future.add_done_callback(log_background_failure("参照音声の特徴量の事前計算"))
+
+
+@app.on_event("startup")
+async def warm_up_audio_processor():
+    """起動時に音声処理を一通り実行し、最初のリクエストだけが遅くなるのを防ぐ（リクエスト受付はブロックしない）"""
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(None, audio_processor.warm_up)
+    future.add_done_callback(log_background_failure("音声処理のウォームアップ"))
+
+
+async def receive_upload(
+    audio: UploadFile,
+    file_path: Path,
+    keep_in_memory: bool
+) -> Tuple[Union[str, io.BytesIO], int, str]:
+    """
+    アップロードされた音声を受け取り、同時にハッシュを計算する
+    
+    小さい録音はメモリ上（BytesIO）に置いたまま返し、
+    UPLOAD_MEMORY_LIMITを超えた場合やkeep_in_memoryがFalseの場合はディスクに書き出す
+    
+    Parameters:
+    - audio: アップロードされた音声
+    - file_path: ディスクに書き出す場合の保存先
+    - keep_in_memory: メモリ上で処理してよいか
+    
+    Returns:
+    - user_audio: メモリ上の音声、または保存先のパス
+    - file_size: ファイルサイズ
+    - digest: 音声のハッシュ
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    buffer = io.BytesIO()
+    file_size = 0
+    disk_file = None
+    too_large = False
+    completed = False
+    try:
+        # チャンクごとに受け取り、ディスクへの書き込みは非同期で行いイベントループを止めない
+        while chunk := await audio.read(UPLOAD_CHUNK_SIZE):
+            file_size += len(chunk)
+            if file_size > MAX_UPLOAD_BYTES:
+                # 上限を超えたら残りは読まずに打ち切る
+                too_large = True
+                break
+            hasher.update(chunk)
+            if disk_file is None and (not keep_in_memory or file_size > UPLOAD_MEMORY_LIMIT):
+                # メモリに溜めた分を書き出し、以降はディスクに直接書く
+                disk_file = await aiofiles.open(file_path, "wb")
+                await disk_file.write(buffer.getvalue())
+                buffer = None
+            if disk_file is not None:
+                await disk_file.write(chunk)
+            else:
+                buffer.write(chunk)
+        completed = not too_large
+    finally:
+        if disk_file is not None:
+            await disk_file.close()
+            # 上限超過やクライアントの切断などで途中まで書き出したファイルは残さない
+            if not completed:
+                file_path.unlink(missing_ok=True)
+    
+    if too_large:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Audio file too large. Maximum size: {MAX_UPLOAD_BYTES // (1024 * 1024)} MB"
+        )
+    
+    if disk_file is None:
+        buffer.seek(0)
+        return buffer, file_size, hasher.hexdigest()
+    return str(file_path), file_size, hasher.hexdigest()
+
 
 def check_app_version(app_version: Optional[str]) -> bool:
     """
@@ -73,6 +290,22 @@ def check_app_version(app_version: Optional[str]) -> bool:
         return False
 
 
+def require_app_version(app_version: Optional[str]):
+    """
+    アプリのバージョンが古い場合は426エラーにする
+    """
+    if not check_app_version(app_version):
+        raise HTTPException(
+            status_code=426,
+            detail={
+                "error": "app_update_required",
+                "message": f"アプリのバージョンが古いため、使用できません。最新バージョン（{MINIMUM_APP_VERSION}以上）にアップデートしてください。",
+                "minimum_version": MINIMUM_APP_VERSION,
+                "current_version": app_version or "unknown"
+            }
+        )
+
+
 @app.get("/")
 async def root():
     """ヘルスチェック用エンドポイント"""
@@ -117,79 +350,60 @@ def get_reference_audio_path(word: str) -> Path:
     - reference_path: 参照音声ファイルのパス
     """
     # 単語をファイル名に変換（スペースをアンダースコアに、記号を削除）
-    safe_word = word.lower().replace(" ", "_").replace("'", "").replace(",", "").replace("?", "").replace("!", "").replace(".", "").replace("-", "_")
+    safe_word = word.lower().translate(SAFE_WORD_TABLE)
     
-    # 複数の拡張子を試す（MP3優先、次にWAV）
-    for ext in [".mp3", ".wav", ".m4a", ".ogg"]:
-        reference_filename = f"{safe_word}_ref{ext}"
-        reference_path = REFERENCE_DIR / reference_filename
-        if reference_path.exists():
-            return reference_path
+    # 参照音声が追加・削除されていれば索引を作り直す
+    refresh_reference_index()
     
+    # 索引から探す（MP3優先、次にWAV）
     # 見つからない場合はMP3パスを返す（エラーハンドリング用）
-    return REFERENCE_DIR / f"{safe_word}_ref.mp3"
+    return REFERENCE_INDEX.get(safe_word, REFERENCE_DIR / f"{safe_word}_ref.mp3")
 
 
-@app.post("/api/pronounce/check")
-async def check_pronunciation(
-    audio: UploadFile = File(...),
-    word: str = Form(None),
-    language: str = Form("bisaya"),
-    level: str = Form("beginner"),
-    app_version: Optional[str] = Header(None, alias="X-App-Version")
-):
+async def diagnose_upload(
+    audio: UploadFile,
+    word: Optional[str],
+    language: str,
+    level: str
+) -> Dict:
     """
-    発音診断エンドポイント
+    アップロードされた1件の音声を診断してレスポンスを作成
     
     Parameters:
-    - audio: 音声ファイル（WAV, MP3, M4A など）
-    - word: 発音対象の単語（オプション）
-    - language: 言語（デフォルト: bisaya）
-    - level: ユーザーのレベル（beginner/intermediate/advanced）
-    - app_version: アプリのバージョン（ヘッダー: X-App-Version）
+    - audio: 音声ファイル
+    - word: 発音対象の単語（Noneの場合は比較しない）
+    - language: 言語
+    - level: ユーザーのレベル
     
     Returns:
-    - JSON形式の診断結果
+    - response: 診断結果のレスポンス
     """
-    # アプリバージョンチェック
-    if not check_app_version(app_version):
+    # ファイル形式チェック
+    file_ext = os.path.splitext(audio.filename)[1].lower()
+    
+    if file_ext not in ALLOWED_EXTENSIONS:
         raise HTTPException(
-            status_code=426,
-            detail={
-                "error": "app_update_required",
-                "message": f"アプリのバージョンが古いため、使用できません。最新バージョン（{MINIMUM_APP_VERSION}以上）にアップデートしてください。",
-                "minimum_version": MINIMUM_APP_VERSION,
-                "current_version": app_version or "unknown"
-            }
+            status_code=400,
+            detail=f"Unsupported file format. Allowed: {ALLOWED_EXTENSIONS_TEXT}"
         )
     
+    # レベルの検証
+    if level not in VALID_LEVELS:
+        level = "beginner"
+    
+    # 音声ファイルを一時保存
+    # 同じ秒に届いたアップロードが上書きし合わないよう、ファイル名には一意なIDを使う
+    # （クライアントが送ったファイル名はパスに使わない）
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f"{timestamp}_{uuid.uuid4().hex[:12]}{file_ext}"
+    file_path = UPLOAD_DIR / filename
+    
+    # 小さい録音はディスクに書かずにメモリ上で処理する
+    # 受信と同時にハッシュを計算し、診断結果のキャッシュキーに使う
+    keep_in_memory = not RETAIN_UPLOADS and audio_processor.can_load_from_memory(file_ext)
+    user_audio, file_size, audio_digest = await receive_upload(audio, file_path, keep_in_memory)
+    
     try:
-        # ファイル形式チェック
-        allowed_extensions = [".wav", ".mp3", ".m4a", ".ogg", ".flac", ".3gp", ".amr"]
-        file_ext = os.path.splitext(audio.filename)[1].lower()
-        
-        if file_ext not in allowed_extensions:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Unsupported file format. Allowed: {', '.join(allowed_extensions)}"
-            )
-        
-        # レベルの検証
-        valid_levels = ["beginner", "intermediate", "advanced"]
-        if level not in valid_levels:
-            level = "beginner"
-        
-        # 音声ファイルを一時保存
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{timestamp}_{audio.filename}"
-        file_path = UPLOAD_DIR / filename
-        
-        with file_path.open("wb") as buffer:
-            shutil.copyfileobj(audio.file, buffer)
-        
-        # ファイルサイズ取得
-        file_size = file_path.stat().st_size
-        
         # 発音診断を実行
         print(f"診断リクエスト: word={word}, level={level}, file={file_path}")
         if word:
@@ -198,24 +412,37 @@ async def check_pronunciation(
             print(f"参照音声パス: {reference_path}, exists={reference_path.exists()}")
             
             if reference_path.exists():
+                cache_key = (audio_digest, str(reference_path), reference_path.stat().st_mtime, level)
+                cached = RESPONSE_CACHE.get(cache_key)
                 # 実際の音声処理で発音を比較
                 try:
-                    print(f"音声処理開始: user={file_path}, reference={reference_path}")
-                    comparison = audio_processor.compare_pronunciation(
-                        str(file_path),
-                        str(reference_path),
-                        level
-                    )
+                    if cached is not None:
+                        # 同じ録音は同じ結果になるので、前回の比較結果を再利用
+                        RESPONSE_CACHE.move_to_end(cache_key)
+                        comparison = cached
+                        logger.info("診断結果キャッシュ使用: %s", audio_digest)
+                    else:
+                        print(f"音声処理開始: user={file_path}, reference={reference_path}")
+                        # 音声処理はCPU負荷が高いので、スレッドプールで実行しイベントループを止めない
+                        # （デコード・FFT・DTWはGILを解放するため、同時リクエストも並列に処理できる）
+                        comparison = await run_in_threadpool(
+                            audio_processor.compare_pronunciation,
+                            user_audio,
+                            str(reference_path),
+                            level,
+                            audio_digest
+                        )
+                        RESPONSE_CACHE[cache_key] = comparison
+                        if len(RESPONSE_CACHE) > RESPONSE_CACHE_SIZE:
+                            RESPONSE_CACHE.popitem(last=False)
                     pronunciation_score = comparison['similarity_score']
                     feedback = comparison['feedback']
                     print(f"音声処理成功: score={pronunciation_score}")
                     print(f"フィードバック: rating={feedback.get('rating')}, details数={len(feedback.get('details', []))}")
                 except Exception as e:
-                    import traceback
                     print(f"音声処理エラー: {e}")
                     print(traceback.format_exc())
                     # エラー時はダミースコア
-                    import random
                     pronunciation_score = random.randint(75, 90)
                     print(f"ダミースコア使用: {pronunciation_score}")
                     
@@ -245,7 +472,6 @@ async def check_pronunciation(
                 
                 response_data = {
                     "filename": audio.filename,
-                    "saved_as": filename,
                     "file_size": file_size,
                     "word": word,
                     "language": language,
@@ -273,7 +499,6 @@ async def check_pronunciation(
                     "message": "Audio file received. Reference audio not found, basic analysis performed.",
                     "data": {
                         "filename": audio.filename,
-                        "saved_as": filename,
                         "file_size": file_size,
                         "word": word,
                         "language": language,
@@ -295,7 +520,6 @@ async def check_pronunciation(
                 "message": "Audio file received. No word specified for comparison.",
                 "data": {
                     "filename": audio.filename,
-                    "saved_as": filename,
                     "file_size": file_size,
                     "word": None,
                     "language": language,
@@ -310,19 +534,204 @@ async def check_pronunciation(
                     "timestamp": timestamp
                 }
             }
-        
-        # 処理後、一時ファイルを削除（必要に応じて保持も可能）
-        # file_path.unlink()
-        
-        return JSONResponse(content=response)
-        
+    finally:
+        # ディスクに書き出した録音は処理後に削除（DEBUG_RETAIN_UPLOADS=1の場合は残す）
+        if isinstance(user_audio, str) and not RETAIN_UPLOADS:
+            Path(user_audio).unlink(missing_ok=True)
+    
+    # 保存したファイル名は、録音を残している場合だけ返す（通常は処理後に削除されている）
+    if RETAIN_UPLOADS:
+        response["data"]["saved_as"] = filename
+    
+    return response
+
+
+@app.post("/api/pronounce/check")
+async def check_pronunciation(
+    audio: UploadFile = File(...),
+    word: str = Form(None),
+    language: str = Form("bisaya"),
+    level: str = Form("beginner"),
+    app_version: Optional[str] = Header(None, alias="X-App-Version")
+):
+    """
+    発音診断エンドポイント
+    
+    Parameters:
+    - audio: 音声ファイル（WAV, MP3, M4A など）
+    - word: 発音対象の単語（オプション）
+    - language: 言語（デフォルト: bisaya）
+    - level: ユーザーのレベル（beginner/intermediate/advanced）
+    - app_version: アプリのバージョン（ヘッダー: X-App-Version）
+    
+    Returns:
+    - JSON形式の診断結果
+    """
+    # アプリバージョンチェック
+    require_app_version(app_version)
+    
+    try:
+        response = await diagnose_upload(audio, word, language, level)
+        return ORJSONResponse(content=response)
+    
+    except HTTPException:
+        raise
     except Exception as e:
-        import traceback
         error_detail = f"Error processing audio: {str(e)}\n{traceback.format_exc()}"
         print(error_detail)  # サーバーログに詳細を出力
         raise HTTPException(status_code=500, detail=f"Error processing audio: {str(e)}")
 
 
+@app.post("/api/pronounce/check-batch")
+async def check_pronunciation_batch(
+    audios: List[UploadFile] = File(...),
+    words: List[str] = Form(...),
+    language: str = Form("bisaya"),
+    level: str = Form("beginner"),
+    app_version: Optional[str] = Header(None, alias="X-App-Version")
+):
+    """
+    複数フレーズの一括発音診断エンドポイント（レッスン全体の採点用）
+    
+    Parameters:
+    - audios: 音声ファイルのリスト
+    - words: 各音声に対応する単語のリスト（audiosと同じ順序）
+    - language: 言語（デフォルト: bisaya）
+    - level: ユーザーのレベル（beginner/intermediate/advanced）
+    - app_version: アプリのバージョン（ヘッダー: X-App-Version）
+    
+    Returns:
+    - JSON形式の診断結果（resultsに入力と同じ順序で1件ずつの結果）
+    """
+    # アプリバージョンチェック
+    require_app_version(app_version)
+    
+    if len(audios) != len(words):
+        raise HTTPException(
+            status_code=400,
+            detail=f"The number of audios ({len(audios)}) and words ({len(words)}) must match"
+        )
+    
+    try:
+        # 各フレーズの診断を並行して実行（比較処理はそれぞれスレッドプールで動く）
+        responses = await asyncio.gather(*[
+            diagnose_upload(audio, word, language, level)
+            for audio, word in zip(audios, words)
+        ])
+        return ORJSONResponse(content={
+            "status": "success",
+            "message": f"{len(responses)} audio files received and processed",
+            "results": responses
+        })
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Error processing audio: %s", e)  # サーバーログに詳細を出力
+        raise HTTPException(status_code=500, detail=f"Error processing audio: {str(e)}")
+
+
+@app.post("/api/pronounce/check-levels")
+async def check_pronunciation_levels(
+    audio: UploadFile = File(...),
+    word: str = Form(...),
+    levels: List[str] = Form(...),
+    language: str = Form("bisaya"),
+    app_version: Optional[str] = Header(None, alias="X-App-Version")
+):
+    """
+    1つの録音を複数レベルで診断するエンドポイント（アップロードと特徴量抽出は1回だけ）
+    
+    Parameters:
+    - audio: 音声ファイル（WAV, MP3, M4A など）
+    - word: 発音対象の単語
+    - levels: 評価するレベルのリスト（beginner/intermediate/advanced）
+    - language: 言語（デフォルト: bisaya）
+    - app_version: アプリのバージョン（ヘッダー: X-App-Version）
+    
+    Returns:
+    - JSON形式の診断結果（per_levelにレベルごとのスコアとフィードバック）
+    """
+    # アプリバージョンチェック
+    require_app_version(app_version)
+    
+    file_ext = os.path.splitext(audio.filename)[1].lower()
+    if file_ext not in ALLOWED_EXTENSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported file format. Allowed: {ALLOWED_EXTENSIONS_TEXT}"
+        )
+    
+    # レベルの検証（不正な値はbeginnerとして扱い、同じレベルは1回だけ評価）
+    levels = list(dict.fromkeys(level if level in VALID_LEVELS else "beginner" for level in levels))
+    
+    reference_path = get_reference_audio_path(word)
+    if not reference_path.exists():
+        raise HTTPException(status_code=404, detail=f"Reference audio for '{word}' not found")
+    
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f"{timestamp}_{uuid.uuid4().hex[:12]}{file_ext}"
+    file_path = UPLOAD_DIR / filename
+    
+    keep_in_memory = not RETAIN_UPLOADS and audio_processor.can_load_from_memory(file_ext)
+    user_audio, file_size, audio_digest = await receive_upload(audio, file_path, keep_in_memory)
+    
+    try:
+        logger.info("複数レベル診断リクエスト: word=%s, levels=%s, file=%s", word, levels, file_path)
+        comparisons = await run_in_threadpool(
+            audio_processor.compare_pronunciation_levels,
+            user_audio,
+            str(reference_path),
+            levels,
+            audio_digest
+        )
+    except Exception as e:
+        logger.exception("Error processing audio: %s", e)  # サーバーログに詳細を出力
+        raise HTTPException(status_code=500, detail=f"Error processing audio: {str(e)}")
+    finally:
+        # ディスクに書き出した録音は処理後に削除（DEBUG_RETAIN_UPLOADS=1の場合は残す）
+        if isinstance(user_audio, str) and not RETAIN_UPLOADS:
+            Path(user_audio).unlink(missing_ok=True)
+    
+    # 単一レベルのエンドポイントでも再利用できるよう、レベルごとの結果をキャッシュに入れる
+    reference_mtime = reference_path.stat().st_mtime
+    for level, comparison in comparisons.items():
+        RESPONSE_CACHE[(audio_digest, str(reference_path), reference_mtime, level)] = comparison
+    while len(RESPONSE_CACHE) > RESPONSE_CACHE_SIZE:
+        RESPONSE_CACHE.popitem(last=False)
+    
+    # 特徴量はレベルに依存しないので、比較詳細は1つだけ返す
+    first = comparisons[levels[0]]
+    response_data = {
+        "filename": audio.filename,
+        "file_size": file_size,
+        "word": word,
+        "language": language,
+        "per_level": {
+            level: {
+                "pronunciation_score": comparison['similarity_score'],
+                "feedback": comparison['feedback']
+            }
+            for level, comparison in comparisons.items()
+        },
+        "comparison_details": {
+            "user_features": first['user_features'],
+            "reference_features": first['reference_features']
+        },
+        "timestamp": timestamp
+    }
+    
+    # 保存したファイル名は、録音を残している場合だけ返す
+    if RETAIN_UPLOADS:
+        response_data["saved_as"] = filename
+    
+    return ORJSONResponse(content={
+        "status": "success",
+        "message": f"Audio file received and processed for {len(levels)} levels",
+        "data": response_data
+    })
+
+
 @app.get("/api/health")
 async def health_check():
     """詳細なヘルスチェック"""
@@ -335,20 +744,34 @@ async def health_check():
 
 
 @app.get("/api/reference-audio/{word}")
-async def get_reference_audio(word: str):
+async def get_reference_audio(
+    word: str,
+    if_none_match: Optional[str] = Header(None)
+):
     """参照音声ファイルを取得"""
-    from fastapi.responses import FileResponse
-    
     # 参照音声ファイルのパスを取得
     reference_path = get_reference_audio_path(word)
     
-    if not reference_path.exists():
+    try:
+        stat = reference_path.stat()
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail=f"Reference audio not found for word: {word}")
     
+    headers = {
+        "Cache-Control": REFERENCE_CACHE_CONTROL,
+        "ETag": f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    }
+    
+    # クライアントが同じファイルを持っている場合は本体を送らない
+    if if_none_match and headers["ETag"] in if_none_match:
+        return Response(status_code=304, headers=headers)
+    
     return FileResponse(
         path=str(reference_path),
-        media_type="audio/mpeg",
-        filename=f"{word}_ref.mp3"
+        media_type=REFERENCE_MEDIA_TYPES.get(reference_path.suffix, "application/octet-stream"),
+        filename=f"{word}_ref{reference_path.suffix}",
+        headers=headers,
+        stat_result=stat
     )
 
 
@@ -2,12 +2,56 @@
 音声認識サービス - Whisper APIを使用した音声認識
 """
 
+import asyncio
+import hashlib
 import os
+import shutil
+import subprocess
+import threading
+import uuid
+from collections import OrderedDict
 from pathlib import Path
-from typing import Optional, Dict
+from typing import Optional, Dict, Tuple
+import librosa
+import numpy as np
+import soundfile as sf
 import speech_recognition as sr
-from pydub import AudioSegment
-import tempfile
+from gtts import gTTS
+
+# 音声認識に送る音声のサンプリングレート（音声認識には16kHzで十分で、送信量も減る）
+STT_SAMPLE_RATE = 16000
+
+# 文字起こし結果のキャッシュ件数（同じ録音の再送信ではAPIを呼ばない）
+TRANSCRIPTION_CACHE_SIZE = 256
+
+# 生成した音声のキャッシュ（テキストと言語のハッシュをファイル名にする）
+TTS_CACHE_DIR = Path("audio_files/tts_cache")
+
+# Google Speech Recognition用の言語コード
+STT_LANGUAGE_CODES = {
+    "bisaya": "ceb-PH",
+    "ceb": "ceb-PH",
+    "cebuano": "ceb-PH",
+    "en": "en-US",
+    "english": "en-US",
+    "ja": "ja-JP",
+    "japanese": "ja-JP",
+    "tl": "tl-PH",
+    "tagalog": "tl-PH"
+}
+
+# gTTS用の言語コード（gTTSはビサヤ語に対応していないため、タガログ語で代用）
+TTS_LANGUAGE_CODES = {
+    "bisaya": "tl",  # タガログ語で代用
+    "ceb": "tl",
+    "cebuano": "tl",
+    "en": "en",
+    "english": "en",
+    "ja": "ja",
+    "japanese": "ja",
+    "tl": "tl",
+    "tagalog": "tl"
+}
 
 class SpeechRecognitionService:
     """音声認識サービス"""
@@ -15,6 +59,16 @@ class SpeechRecognitionService:
     def __init__(self):
         """初期化"""
         self.recognizer = sr.Recognizer()
+        # 文字起こし結果のキャッシュ（キー: (ファイル内容のハッシュ, 言語)）
+        self._transcription_cache: "OrderedDict[Tuple[str, str], Dict]" = OrderedDict()
+        # transcribe_audio_asyncで複数のスレッドから使われるため、読み書きはロックの中で行う
+        self._transcription_cache_lock = threading.Lock()
+    
+    async def transcribe_audio_async(self, audio_file_path: str, language: str = "ceb") -> Dict:
+        """
+        transcribe_audioをスレッドで実行（音声認識APIの通信でイベントループを止めない）
+        """
+        return await asyncio.to_thread(self.transcribe_audio, audio_file_path, language)
     
     def transcribe_audio(self, audio_file_path: str, language: str = "ceb") -> Dict:
         """
@@ -36,41 +90,57 @@ class SpeechRecognitionService:
                     "error": "Audio file not found"
                 }
             
-            # WAV形式に変換（必要な場合）
-            wav_path = self._convert_to_wav(audio_file_path)
+            # 同じ録音は同じ結果になるので、前回の結果があればAPIを呼ばない
+            cache_key = (
+                hashlib.blake2b(file_path.read_bytes(), digest_size=16).hexdigest(),
+                language
+            )
+            with self._transcription_cache_lock:
+                cached = self._transcription_cache.get(cache_key)
+                if cached is not None:
+                    self._transcription_cache.move_to_end(cache_key)
+            if cached is not None:
+                return dict(cached)
+            
+            # 音声データを読み込み（WAV以外はFFmpegでPCMに変換）
+            audio_data = self._read_audio_data(audio_file_path)
             
             # 音声認識を実行
-            with sr.AudioFile(wav_path) as source:
-                audio_data = self.recognizer.record(source)
+            try:
+                # Google Speech Recognitionを使用（無料）
+                # ビサヤ語の認識精度は限定的だが、基本的な単語は認識可能
+                text = self.recognizer.recognize_google(
+                    audio_data,
+                    language=self._get_language_code(language)
+                )
+                
+                result = {
+                    "status": "success",
+                    "transcription": text,
+                    "language": language,
+                    "confidence": 0.8  # Google APIは信頼度を返さないため固定値
+                }
                 
-                try:
-                    # Google Speech Recognitionを使用（無料）
-                    # ビサヤ語の認識精度は限定的だが、基本的な単語は認識可能
-                    text = self.recognizer.recognize_google(
-                        audio_data,
-                        language=self._get_language_code(language)
-                    )
-                    
-                    return {
-                        "status": "success",
-                        "transcription": text,
-                        "language": language,
-                        "confidence": 0.8  # Google APIは信頼度を返さないため固定値
-                    }
-                    
-                except sr.UnknownValueError:
-                    return {
-                        "status": "error",
-                        "error": "Could not understand audio",
-                        "transcription": ""
-                    }
-                    
-                except sr.RequestError as e:
-                    return {
-                        "status": "error",
-                        "error": f"API request failed: {str(e)}",
-                        "transcription": ""
-                    }
+                # 成功した結果だけをキャッシュ（通信エラーなどは次回やり直す）
+                with self._transcription_cache_lock:
+                    self._transcription_cache[cache_key] = result
+                    if len(self._transcription_cache) > TRANSCRIPTION_CACHE_SIZE:
+                        self._transcription_cache.popitem(last=False)
+                return dict(result)
+                
+            except sr.UnknownValueError:
+                return {
+                    "status": "error",
+                    "error": "Could not understand audio",
+                    "transcription": ""
+                }
+                
+            except sr.RequestError as e:
+                return {
+                    "status": "error",
+                    "error": f"API request failed: {str(e)}",
+                    "transcription": ""
+                }
             
         except Exception as e:
             return {
@@ -78,57 +148,37 @@ class SpeechRecognitionService:
                 "error": f"Transcription failed: {str(e)}",
                 "transcription": ""
             }
-        finally:
-            # 一時ファイルを削除
-            if wav_path != audio_file_path and Path(wav_path).exists():
-                Path(wav_path).unlink()
     
-    def _convert_to_wav(self, audio_file_path: str) -> str:
+    def _read_audio_data(self, audio_file_path: str) -> sr.AudioData:
         """
-        音声ファイルをWAV形式に変換
+        音声ファイルを音声認識用のデータとして読み込む
+        
+        WAV以外の形式は、FFmpegでモノラル・16kHzの16bit PCMに1回でデコードして
+        標準出力から直接受け取る（一時WAVファイルへの書き出しなし）
         
         Parameters:
-        - audio_file_path: 元の音声ファイルパス
+        - audio_file_path: 音声ファイルのパス
         
         Returns:
-        - WAVファイルのパス
+        - 音声認識用の音声データ
         """
-        file_path = Path(audio_file_path)
-        file_ext = file_path.suffix.lower()
-        
-        # すでにWAV形式の場合はそのまま返す
-        if file_ext == '.wav':
-            return audio_file_path
+        if Path(audio_file_path).suffix.lower() != '.wav':
+            try:
+                result = subprocess.run([
+                    'ffmpeg', '-loglevel', 'error',
+                    '-i', audio_file_path,
+                    '-ac', '1',
+                    '-ar', str(STT_SAMPLE_RATE),
+                    '-f', 's16le',
+                    '-'
+                ], check=True, capture_output=True, timeout=30)
+                return sr.AudioData(result.stdout, STT_SAMPLE_RATE, 2)
+            except (OSError, subprocess.SubprocessError) as e:
+                # 変換できない場合は元のファイルをそのまま読み込む
+                print(f"Audio conversion error: {e}")
         
-        try:
-            # 音声ファイルを読み込み
-            if file_ext == '.mp3':
-                audio = AudioSegment.from_mp3(audio_file_path)
-            elif file_ext == '.m4a':
-                audio = AudioSegment.from_file(audio_file_path, format='m4a')
-            elif file_ext == '.ogg':
-                audio = AudioSegment.from_ogg(audio_file_path)
-            elif file_ext == '.flac':
-                audio = AudioSegment.from_file(audio_file_path, format='flac')
-            elif file_ext in ['.3gp', '.amr']:
-                audio = AudioSegment.from_file(audio_file_path)
-            else:
-                # 不明な形式の場合は元のパスを返す
-                return audio_file_path
-            
-            # 一時WAVファイルを作成
-            temp_wav = tempfile.NamedTemporaryFile(delete=False, suffix='.wav')
-            temp_wav_path = temp_wav.name
-            temp_wav.close()
-            
-            # WAV形式でエクスポート
-            audio.export(temp_wav_path, format='wav')
-            
-            return temp_wav_path
-            
-        except Exception as e:
-            print(f"Audio conversion error: {e}")
-            return audio_file_path
+        with sr.AudioFile(audio_file_path) as source:
+            return self.recognizer.record(source)
     
     def _get_language_code(self, language: str) -> str:
         """
@@ -140,19 +190,7 @@ class SpeechRecognitionService:
         Returns:
         - Google Speech Recognition用の言語コード
         """
-        language_map = {
-            "bisaya": "ceb-PH",
-            "ceb": "ceb-PH",
-            "cebuano": "ceb-PH",
-            "en": "en-US",
-            "english": "en-US",
-            "ja": "ja-JP",
-            "japanese": "ja-JP",
-            "tl": "tl-PH",
-            "tagalog": "tl-PH"
-        }
-        
-        return language_map.get(language.lower(), "ceb-PH")
+        return STT_LANGUAGE_CODES.get(language.lower(), "ceb-PH")
     
     def analyze_pronunciation_features(self, audio_file_path: str) -> Dict:
         """
@@ -165,26 +203,27 @@ class SpeechRecognitionService:
         - 発音特徴の分析結果
         """
         try:
-            import librosa
-            import numpy as np
-            
-            # 音声ファイルを読み込み
-            y, sr = librosa.load(audio_file_path, sr=None)
+            # 音声ファイルを読み込み（soundfileで直接float32として1回だけデコードし、
+            # 読めない形式（M4Aなど）だけlibrosaに任せる）
+            try:
+                y, sr = sf.read(audio_file_path, dtype='float32', always_2d=False)
+                if y.ndim > 1:
+                    y = y.mean(axis=1, dtype=np.float32)
+            except RuntimeError:
+                y, sr = librosa.load(audio_file_path, sr=None)
             
             # 基本的な特徴量を抽出
             duration = librosa.get_duration(y=y, sr=sr)
             
             # ピッチ（基本周波数）を抽出
+            # 各フレームで最も強い周波数ビンのピッチを一度に取り出す
             pitches, magnitudes = librosa.piptrack(y=y, sr=sr)
-            pitch_values = []
-            for t in range(pitches.shape[1]):
-                index = magnitudes[:, t].argmax()
-                pitch = pitches[index, t]
-                if pitch > 0:
-                    pitch_values.append(pitch)
+            strongest = magnitudes.argmax(axis=0)
+            pitch_values = pitches[strongest, np.arange(pitches.shape[1])]
+            pitch_values = pitch_values[pitch_values > 0]
             
-            pitch_mean = np.mean(pitch_values) if pitch_values else 0
-            pitch_std = np.std(pitch_values) if pitch_values else 0
+            pitch_mean = np.mean(pitch_values) if pitch_values.size else 0
+            pitch_std = np.std(pitch_values) if pitch_values.size else 0
             
             # エネルギー（音量）を計算
             rms = librosa.feature.rms(y=y)[0]
@@ -221,33 +260,47 @@ class TextToSpeechService:
         """初期化"""
         pass
     
+    async def generate_speech_async(self, text: str, language: str = "ceb", output_path: Optional[str] = None) -> Dict:
+        """
+        generate_speechをスレッドで実行（gTTSの通信でイベントループを止めない）
+        """
+        return await asyncio.to_thread(self.generate_speech, text, language, output_path)
+    
     def generate_speech(self, text: str, language: str = "ceb", output_path: Optional[str] = None) -> Dict:
         """
         テキストから音声を生成
         
+        同じテキスト・言語の音声はTTS_CACHE_DIRに保存して使い回し、gTTSを呼ばない
+        
         Parameters:
         - text: 音声化するテキスト
         - language: 言語コード
-        - output_path: 出力ファイルパス（Noneの場合は一時ファイル）
+        - output_path: 出力ファイルパス（Noneの場合はキャッシュのファイルのパスを返す）
         
         Returns:
         - 生成結果
         """
         try:
-            from gtts import gTTS
-            
-            # 出力パスが指定されていない場合は一時ファイルを作成
-            if output_path is None:
-                temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.mp3')
-                output_path = temp_file.name
-                temp_file.close()
-            
             # 言語コードを取得
             lang_code = self._get_tts_language_code(language)
             
-            # 音声を生成
-            tts = gTTS(text=text, lang=lang_code, slow=False)
-            tts.save(output_path)
+            text_hash = hashlib.sha1(f"{text}|{lang_code}".encode("utf-8")).hexdigest()
+            cache_path = TTS_CACHE_DIR / f"{text_hash}.mp3"
+            
+            if not cache_path.exists():
+                # 音声を生成
+                # 書き込み途中のファイルを返さないよう、一時ファイルに保存してから置き換える
+                TTS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                tts = gTTS(text=text, lang=lang_code, slow=False)
+                temp_path = cache_path.with_name(f"{cache_path.name}.{uuid.uuid4().hex}.tmp")
+                tts.save(str(temp_path))
+                os.replace(temp_path, cache_path)
+            
+            # 出力パスが指定されている場合はそこにコピー
+            if output_path is None:
+                output_path = str(cache_path)
+            else:
+                shutil.copyfile(cache_path, output_path)
             
             return {
                 "status": "success",
@@ -269,16 +322,4 @@ class TextToSpeechService:
         Note: gTTSはビサヤ語（セブアノ語）を直接サポートしていないため、
         タガログ語（tl）またはフィリピン英語（en）を使用
         """
-        language_map = {
-            "bisaya": "tl",  # タガログ語で代用
-            "ceb": "tl",
-            "cebuano": "tl",
-            "en": "en",
-            "english": "en",
-            "ja": "ja",
-            "japanese": "ja",
-            "tl": "tl",
-            "tagalog": "tl"
-        }
-        
-        return language_map.get(language.lower(), "tl")
+        return TTS_LANGUAGE_CODES.get(language.lower(), "tl")
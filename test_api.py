@@ -3,16 +3,27 @@ APIテスト用スクリプト
 サーバーが正常に動作しているか確認するためのテストコード
 """
 
+import asyncio
 import requests
 import json
+import time
 from pathlib import Path
 
+BASE_URL = "http://localhost:8000"
+
+# サーバーが要求するアプリのバージョン（X-App-Versionヘッダーで送る）
+APP_VERSION = "1.0.9"
+
+# 接続を使い回すセッション（リクエストごとにTCP接続を張り直さない）
+SESSION = requests.Session()
+SESSION.headers["X-App-Version"] = APP_VERSION
+
 
 def test_root_endpoint():
     """ルートエンドポイントのテスト"""
     print("Testing root endpoint...")
     try:
-        response = requests.get("http://localhost:8000/")
+        response = SESSION.get(f"{BASE_URL}/")
         print(f"Status Code: {response.status_code}")
         print(f"Response: {json.dumps(response.json(), indent=2)}")
         return response.status_code == 200
@@ -25,7 +36,7 @@ def test_health_endpoint():
     """ヘルスチェックエンドポイントのテスト"""
     print("\nTesting health endpoint...")
     try:
-        response = requests.get("http://localhost:8000/api/health")
+        response = SESSION.get(f"{BASE_URL}/api/health")
         print(f"Status Code: {response.status_code}")
         print(f"Response: {json.dumps(response.json(), indent=2)}")
         return response.status_code == 200
@@ -52,8 +63,8 @@ def test_pronunciation_check(audio_file_path: str = None):
                 'language': 'bisaya'
             }
             
-            response = requests.post(
-                "http://localhost:8000/api/pronounce/check",
+            response = SESSION.post(
+                f"{BASE_URL}/api/pronounce/check",
                 files=files,
                 data=data
             )
@@ -66,6 +77,46 @@ def test_pronunciation_check(audio_file_path: str = None):
         return False
 
 
+def test_concurrent_pronunciation_check(audio_file_path: str = None, count: int = 8):
+    """発音診断エンドポイントに同時にリクエストを送るテスト（並行処理の確認用）"""
+    print(f"\nTesting {count} concurrent pronunciation checks...")
+    
+    if not audio_file_path or not Path(audio_file_path).exists():
+        print("No audio file provided or file not found. Skipping this test.")
+        return None
+    
+    # 並行リクエストにだけ使うので、ここで初めて読み込む
+    import httpx
+    
+    audio_bytes = Path(audio_file_path).read_bytes()
+    filename = Path(audio_file_path).name
+    
+    async def send_all():
+        async with httpx.AsyncClient(base_url=BASE_URL, timeout=60) as client:
+            return await asyncio.gather(*[
+                client.post(
+                    "/api/pronounce/check",
+                    files={'audio': (filename, audio_bytes)},
+                    data={'word': 'maayong buntag', 'language': 'bisaya'},
+                    headers={'X-App-Version': APP_VERSION}
+                )
+                for _ in range(count)
+            ])
+    
+    try:
+        start = time.perf_counter()
+        responses = asyncio.run(send_all())
+        elapsed = time.perf_counter() - start
+        
+        status_codes = [response.status_code for response in responses]
+        print(f"Status Codes: {status_codes}")
+        print(f"Elapsed: {elapsed:.2f}s ({elapsed / count:.2f}s per request)")
+        return all(code == 200 for code in status_codes)
+    except Exception as e:
+        print(f"Error: {e}")
+        return False
+
+
 def main():
     """メインテスト実行"""
     print("=" * 50)
@@ -81,6 +132,7 @@ def main():
     # 音声ファイルのパスを指定してテスト（オプション）
     # audio_file = "path/to/your/test_audio.wav"
     # results.append(("Pronunciation Check", test_pronunciation_check(audio_file)))
+    # results.append(("Concurrent Pronunciation Check", test_concurrent_pronunciation_check(audio_file)))
     
     # 結果サマリー
     print("\n" + "=" * 50)
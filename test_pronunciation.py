@@ -2,11 +2,58 @@
 発音評価機能のテストスクリプト
 """
 
+import argparse
+import asyncio
+import functools
+import os
 import requests
+import hashlib
 import json
+import shutil
 from pathlib import Path
 import numpy as np
 import soundfile as sf
+from requests.adapters import HTTPAdapter
+
+try:
+    import orjson
+except ImportError:
+    # orjsonがない環境では標準のjsonでパース
+    orjson = None
+
+# サーバーが要求するアプリのバージョン（X-App-Versionヘッダーで送る）
+APP_VERSION = "1.0.9"
+
+# 接続を使い回すセッション（リクエストごとにTCP接続を張り直さない）
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+SESSION.headers["X-App-Version"] = APP_VERSION
+
+# 生成したテスト音声のキャッシュ（同じ設定なら次回以降は生成しない）
+TEST_AUDIO_CACHE_DIR = Path(".cache")
+
+# 発音評価APIのレスポンスのキャッシュ（--cachedを指定した場合のみ使う）
+RESPONSE_CACHE_DIR = TEST_AUDIO_CACHE_DIR / "responses"
+RESPONSE_CACHE_LIMIT = 100
+
+# テスト音声のハーモニクスの周波数（参照音声より少し高め）と振幅（高次ハーモニクスは小さく）
+_FREQS = np.array([220, 440, 660, 880], dtype=np.float32)
+_AMPS = np.float32(0.25) / np.arange(1, len(_FREQS) + 1, dtype=np.float32)
+
+
+@functools.lru_cache(maxsize=8)
+def _harmonic_basis(sample_rate: int, duration: float, frequencies: tuple):
+    """
+    時間軸と各ハーモニクスの正弦波（周波数 × サンプル）を作成（同じ設定なら再計算しない）
+    
+    キャッシュした配列を共有するので、書き込み不可にして返す
+    """
+    t = np.linspace(0, duration, int(sample_rate * duration), dtype=np.float32)
+    freqs = np.array(frequencies, dtype=np.float32)
+    sines = np.sin(np.float32(2 * np.pi) * freqs[:, None] * t)
+    t.setflags(write=False)
+    sines.setflags(write=False)
+    return t, sines
 
 
 def create_test_audio(filename: str = "test_user_audio.wav", duration: float = 1.5):
@@ -14,28 +61,171 @@ def create_test_audio(filename: str = "test_user_audio.wav", duration: float = 1
     テスト用のユーザー音声を生成
     """
     sample_rate = 22050
-    t = np.linspace(0, duration, int(sample_rate * duration))
     
-    # 参照音声と少し異なる周波数で生成
-    frequencies = [220, 440, 660, 880]  # 参照音声より少し高め
-    audio = np.zeros_like(t)
+    # 同じ設定の音声は毎回同じになるので、キャッシュがあればコピーするだけ
+    key = hashlib.sha1(f"{sample_rate}|{duration}|{_FREQS.tolist()}|float32".encode("utf-8")).hexdigest()[:12]
+    cache_path = TEST_AUDIO_CACHE_DIR / f"test_audio_{key}.wav"
+    if cache_path.exists():
+        shutil.copyfile(cache_path, filename)
+        print(f"✓ Created test audio: {filename} (cached)")
+        return filename
+    
+    # 計算はfloat32で行う（書き出し時に16bit PCMへ量子化するので精度は十分）
+    t, sines = _harmonic_basis(sample_rate, duration, tuple(_FREQS.tolist()))
     
-    for i, freq in enumerate(frequencies):
-        amplitude = 0.25 / (i + 1)
-        audio += amplitude * np.sin(2 * np.pi * freq * t)
+    # 全ハーモニクスの正弦波を(周波数 × サンプル)の行列で一度に計算し、振幅で重み付けして合成
+    audio = _AMPS @ sines
     
-    envelope = np.exp(-t * 0.6)
-    audio = audio * envelope
-    audio = audio / np.max(np.abs(audio)) * 0.7
+    # 減衰エンベロープは1つのバッファ上で計算し、一時配列を作らない
+    envelope = t * np.float32(-0.6)
+    np.exp(envelope, out=envelope)
+    audio *= envelope
+    # 絶対値の一時配列を作らず、最大値と最小値からピークを求めて正規化
+    peak = max(audio.max(), -audio.min())
+    audio *= np.float32(0.7) / peak
     
-    sf.write(filename, audio.astype(np.float32), sample_rate)
+    # 16bit PCMで書き出す（float32のWAVの半分のサイズでアップロードできる）
+    sf.write(filename, audio, sample_rate, subtype='PCM_16')
+    TEST_AUDIO_CACHE_DIR.mkdir(exist_ok=True)
+    shutil.copyfile(filename, cache_path)
     print(f"✓ Created test audio: {filename}")
     return filename
 
 
-def test_pronunciation_api(audio_file: str, word: str, level: str = "beginner"):
+def parse_json(response):
+    """
+    レスポンスのJSONをパース（orjsonがあればバイト列から直接パースする）
+    """
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return response.json()
+
+
+def is_voiced(audio: np.ndarray, thresh: float = 0.5) -> bool:
+    """
+    スペクトル平坦度で音声が有声（調波成分を含む）かを判定
+    
+    無音や雑音は平坦度が1に近く、調波音は0に近い（FFT 1回で済むのでピッチ推定より軽い）
+    
+    Returns:
+    - 平坦度がthresh以下の場合True
+    """
+    spectrum = np.abs(np.fft.rfft(audio * np.hanning(len(audio))))
+    flatness = np.exp(np.mean(np.log(spectrum + 1e-9))) / (np.mean(spectrum) + 1e-12)
+    return flatness <= thresh
+
+
+def peak_frequency(audio: np.ndarray, sample_rate: int) -> float:
+    """
+    振幅スペクトルが最大になる周波数（Hz）を求める（自己相関によるピッチ推定よりも軽い）
+    """
+    spectrum = np.abs(np.fft.rfft(audio * np.hanning(len(audio))))
+    return float(np.argmax(spectrum) * sample_rate / len(audio))
+
+
+def print_pronunciation_result(response) -> bool:
+    """
+    発音評価APIのレスポンスを表示
+    
+    表示内容は1つの文字列にまとめてから1回で出力する
+    
+    Returns:
+    - 成功した場合True
+    """
+    if response.status_code == 200:
+        result = parse_json(response)
+        lines = [
+            f"\n✓ Status: {result['status']}",
+            f"✓ Message: {result['message']}",
+        ]
+        
+        if 'data' in result:
+            data = result['data']
+            lines.append(f"\n📊 Results:")
+            lines.append(f"  - Word: {data.get('word')}")
+            lines.append(f"  - Level: {data.get('level')}")
+            lines.append(f"  - Pronunciation Score: {data.get('pronunciation_score')}")
+            
+            if 'feedback' in data:
+                feedback = data['feedback']
+                lines.append(f"\n💬 Feedback:")
+                lines.append(f"  - Rating: {feedback.get('rating')}")
+                lines.append(f"  - Overall: {feedback.get('overall')}")
+                
+                if 'details' in feedback and feedback['details']:
+                    lines.append(f"\n  📝 Details:")
+                    for detail in feedback['details']:
+                        lines.append(f"    • {detail.get('aspect')}: {detail.get('comment')}")
+                
+                if 'tips' in feedback:
+                    lines.append(f"\n  💡 Tips: {feedback.get('tips')}")
+            
+            if 'comparison_details' in data:
+                lines.append(f"\n🔍 Comparison Details:")
+                user_feat = data['comparison_details']['user_features']
+                ref_feat = data['comparison_details']['reference_features']
+                lines.append(f"  User Duration: {user_feat['duration']:.2f}s")
+                lines.append(f"  Reference Duration: {ref_feat['duration']:.2f}s")
+                lines.append(f"  User Pitch: {user_feat['pitch_mean']:.2f} Hz")
+                lines.append(f"  Reference Pitch: {ref_feat['pitch_mean']:.2f} Hz")
+        
+        print("\n".join(lines))
+        return True
+    else:
+        print(f"✗ Error: Status code {response.status_code}\n  Response: {response.text}")
+        return False
+
+
+class CachedResponse:
+    """キャッシュから読み込んだレスポンス（print_pronunciation_resultが使う属性だけを持つ）"""
+    
+    status_code = 200
+    
+    def __init__(self, content: bytes):
+        self.content = content
+        self.text = content.decode("utf-8")
+    
+    def json(self):
+        return json.loads(self.content)
+
+
+def post_with_cache(url: str, files: dict, data: dict, audio_bytes: bytes):
+    """
+    発音評価APIを呼び出し、成功したレスポンスをディスクにキャッシュする
+    
+    同じ音声・単語・レベルの組み合わせは前回のレスポンスを返す（最大RESPONSE_CACHE_LIMIT件、古いものから削除）
+    """
+    hasher = hashlib.sha1(audio_bytes)
+    hasher.update(f"|{url}|{data['word']}|{data['language']}|{data['level']}".encode("utf-8"))
+    cache_path = RESPONSE_CACHE_DIR / f"{hasher.hexdigest()}.json"
+    if cache_path.exists():
+        # 最近使ったものが残るよう、更新時刻を使用時刻として扱う
+        os.utime(cache_path)
+        print("(cached response)")
+        return CachedResponse(cache_path.read_bytes())
+    
+    response = SESSION.post(url, files=files, data=data)
+    if response.status_code == 200:
+        RESPONSE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        cache_path.write_bytes(response.content)
+        entries = sorted(RESPONSE_CACHE_DIR.glob("*.json"), key=lambda path: path.stat().st_mtime)
+        for path in entries[:-RESPONSE_CACHE_LIMIT]:
+            path.unlink(missing_ok=True)
+    return response
+
+
+def test_pronunciation_api(
+    audio_file: str,
+    word: str,
+    level: str = "beginner",
+    audio_bytes: bytes = None,
+    use_cache: bool = False
+):
     """
     発音評価APIをテスト
+    
+    audio_bytesを渡した場合はファイルを読み直さずにそのまま送信する
+    use_cacheがTrueの場合は、同じ入力に対する前回のレスポンスを再利用する
     """
     url = "http://localhost:8000/api/pronounce/check"
     
@@ -44,63 +234,63 @@ def test_pronunciation_api(audio_file: str, word: str, level: str = "beginner"):
     print(f"{'='*60}")
     
     try:
-        with open(audio_file, 'rb') as f:
-            files = {'audio': (audio_file, f, 'audio/wav')}
-            data = {
-                'word': word,
-                'language': 'bisaya',
-                'level': level
-            }
-            
-            response = requests.post(url, files=files, data=data)
-            
-            if response.status_code == 200:
-                result = response.json()
-                print(f"\n✓ Status: {result['status']}")
-                print(f"✓ Message: {result['message']}")
-                
-                if 'data' in result:
-                    data = result['data']
-                    print(f"\n📊 Results:")
-                    print(f"  - Word: {data.get('word')}")
-                    print(f"  - Level: {data.get('level')}")
-                    print(f"  - Pronunciation Score: {data.get('pronunciation_score')}")
-                    
-                    if 'feedback' in data:
-                        feedback = data['feedback']
-                        print(f"\n💬 Feedback:")
-                        print(f"  - Rating: {feedback.get('rating')}")
-                        print(f"  - Overall: {feedback.get('overall')}")
-                        
-                        if 'details' in feedback and feedback['details']:
-                            print(f"\n  📝 Details:")
-                            for detail in feedback['details']:
-                                print(f"    • {detail.get('aspect')}: {detail.get('comment')}")
-                        
-                        if 'tips' in feedback:
-                            print(f"\n  💡 Tips: {feedback.get('tips')}")
-                    
-                    if 'comparison_details' in data:
-                        print(f"\n🔍 Comparison Details:")
-                        user_feat = data['comparison_details']['user_features']
-                        ref_feat = data['comparison_details']['reference_features']
-                        print(f"  User Duration: {user_feat['duration']:.2f}s")
-                        print(f"  Reference Duration: {ref_feat['duration']:.2f}s")
-                        print(f"  User Pitch: {user_feat['pitch_mean']:.2f} Hz")
-                        print(f"  Reference Pitch: {ref_feat['pitch_mean']:.2f} Hz")
-                
-                return True
-            else:
-                print(f"✗ Error: Status code {response.status_code}")
-                print(f"  Response: {response.text}")
-                return False
+        if audio_bytes is None:
+            audio_bytes = Path(audio_file).read_bytes()
+        files = {'audio': (audio_file, audio_bytes, 'audio/wav')}
+        data = {
+            'word': word,
+            'language': 'bisaya',
+            'level': level
+        }
+        
+        if use_cache:
+            response = post_with_cache(url, files, data, audio_bytes)
+        else:
+            response = SESSION.post(url, files=files, data=data)
+        return print_pronunciation_result(response)
                 
     except Exception as e:
         print(f"✗ Exception: {e}")
         return False
 
 
-def test_all_levels(audio_file: str, word: str):
+def check_levels_separately(audio_file: str, audio_bytes: bytes, word: str, levels: list) -> dict:
+    """
+    レベルごとに発音評価APIを並行して呼び出す（一括診断に対応していないサーバー用）
+    """
+    # 並行リクエストにだけ使うので、ここで初めて読み込む
+    import httpx
+    
+    async def check_level(client, level: str):
+        return await client.post(
+            "http://localhost:8000/api/pronounce/check",
+            files={'audio': (audio_file, audio_bytes, 'audio/wav')},
+            data={'word': word, 'language': 'bisaya', 'level': level}
+        )
+    
+    async def check_all_levels():
+        # 各レベルのリクエストは独立しているので同時に送る
+        async with httpx.AsyncClient(timeout=60, headers={"X-App-Version": APP_VERSION}) as client:
+            return await asyncio.gather(
+                *[check_level(client, level) for level in levels],
+                return_exceptions=True
+            )
+    
+    responses = asyncio.run(check_all_levels())
+    
+    results = {}
+    for level, response in zip(levels, responses):
+        print(f"\n--- Level: {level} ---")
+        if isinstance(response, Exception):
+            print(f"✗ Exception: {response}")
+            results[level] = False
+        else:
+            results[level] = print_pronunciation_result(response)
+        print()  # 空行
+    return results
+
+
+def test_all_levels(audio_file: str, word: str, audio_bytes: bytes = None):
     """
     全レベルでテスト
     """
@@ -110,11 +300,35 @@ def test_all_levels(audio_file: str, word: str):
     print(f"Testing all levels for word: '{word}'")
     print(f"{'='*60}")
     
+    # 音声は1回だけ読み込み、全レベルのリクエストで使い回す
+    if audio_bytes is None:
+        audio_bytes = Path(audio_file).read_bytes()
+    
+    # 1回のリクエストで全レベルを診断（アップロードと特徴量抽出はサーバー側で1回だけ）
+    response = SESSION.post(
+        "http://localhost:8000/api/pronounce/check-levels",
+        files={'audio': (audio_file, audio_bytes, 'audio/wav')},
+        data={'word': word, 'language': 'bisaya', 'levels': levels}
+    )
+    
     results = {}
-    for level in levels:
-        success = test_pronunciation_api(audio_file, word, level)
-        results[level] = success
-        print()  # 空行
+    if response.status_code == 200:
+        per_level = parse_json(response)['data']['per_level']
+        for level in levels:
+            print(f"\n--- Level: {level} ---")
+            level_result = per_level.get(level)
+            if level_result is None:
+                print(f"✗ Missing result for level: {level}")
+                results[level] = False
+                continue
+            print(f"  - Pronunciation Score: {level_result['pronunciation_score']}")
+            print(f"  - Rating: {level_result['feedback'].get('rating')}")
+            print(f"  - Overall: {level_result['feedback'].get('overall')}")
+            results[level] = True
+    else:
+        # 一括診断に対応していない・失敗したサーバーでは、レベルごとに並行してリクエストする
+        print(f"check-levels failed (status {response.status_code}), falling back to per-level requests")
+        results = check_levels_separately(audio_file, audio_bytes, word, levels)
     
     print(f"\n{'='*60}")
     print("Summary")
@@ -128,6 +342,14 @@ def main():
     """
     メインテスト実行
     """
+    parser = argparse.ArgumentParser(description="Bisaya Speak AI - Test Suite")
+    parser.add_argument(
+        "--cached",
+        action="store_true",
+        help="reuse previous responses for the same audio, word and level (server changes are not detected)"
+    )
+    args = parser.parse_args()
+    
     print("=" * 60)
     print("Bisaya Speak AI - Test Suite")
     print("=" * 60)
@@ -135,8 +357,9 @@ def main():
     # サーバーの稼働確認
     print("\n1. Checking server status...")
     try:
-        response = requests.get("http://localhost:8000/")
-        if response.status_code == 200:
+        # 本文は不要なのでHEADで確認（GETのみのルートは405を返すが、サーバーは稼働している）
+        response = SESSION.head("http://localhost:8000/", timeout=2.0)
+        if response.ok or response.status_code == 405:
             print("✓ Server is running")
         else:
             print("✗ Server returned unexpected status")
@@ -151,19 +374,35 @@ def main():
     print("\n2. Creating test audio...")
     test_audio = create_test_audio()
     
+    # 無音や壊れた音声を送ってもテストにならないので、送信前に確認する
+    audio, sample_rate = sf.read(test_audio, dtype='float32')
+    if not is_voiced(audio):
+        print(f"✗ Test audio is not voiced: {test_audio}")
+        return
+    
+    # 基本周波数（220Hz）が最も強いはずなので、サーバーのピッチ推定と比べる目安になる
+    peak_hz = peak_frequency(audio, sample_rate)
+    if abs(peak_hz - 220) >= 5:
+        print(f"✗ Unexpected peak frequency in test audio: {peak_hz:.1f} Hz (expected 220 Hz)")
+        return
+    
+    # 音声はここで1回だけ読み込み、以降のテストで使い回す
+    audio_bytes = Path(test_audio).read_bytes()
+    
     # 単一テスト
     print("\n3. Testing pronunciation evaluation...")
-    test_pronunciation_api(test_audio, "maayong buntag", "beginner")
+    test_pronunciation_api(test_audio, "maayong buntag", "beginner", audio_bytes, use_cache=args.cached)
     
     # 全レベルテスト
     print("\n4. Testing all difficulty levels...")
-    test_all_levels(test_audio, "maayong buntag")
+    test_all_levels(test_audio, "maayong buntag", audio_bytes)
     
     # クリーンアップ
     print("\n5. Cleanup...")
     if Path(test_audio).exists():
         Path(test_audio).unlink()
         print(f"✓ Removed test file: {test_audio}")
+    SESSION.close()
     
     print("\n" + "=" * 60)
     print("Test Complete!")